@@ -1,6 +1,9 @@
-from flask import Flask, render_template, request, jsonify, send_file, session, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, session, send_from_directory
 import yt_dlp
+from yt_dlp.cookies import YoutubeDLCookieJar
+from yt_dlp.postprocessor import PostProcessor
 import os
+import io
 import uuid
 import threading
 import re
@@ -9,274 +12,3382 @@ import time
 import string
 import random
 import secrets
+import heapq
+import json
+import logging
+import logging.handlers
+import queue
+import asyncio
+import atexit
+import sqlite3
+import contextlib
+import contextvars
+import copy
+import hashlib
+import math
+import mimetypes
+import shutil
+import signal
+import itertools
+import zipfile
+try:
+    import fcntl
+except ImportError:  # Windows: tek süreçli masaüstü kullanımı, süreçler arası kilit gerekmez
+    fcntl = None
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from urllib.parse import quote
+from werkzeug.datastructures import Headers
+from werkzeug.http import http_date, parse_range_header
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+# ============ Logging ============
+# Seviyeli, JSON satırı biçiminde loglar. Kayıtlar kuyruğa bırakılır ve stderr'e ayrı bir
+# thread yazar; istek ve ilerleme yolunda bloklayan I/O yapılmaz. Her kayıt isteğin veya
+# indirme işinin trace ID'sini taşır; ilerleme gibi sık olaylar örneklenerek loglanır.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+YTDLP_LOG_LEVEL = os.environ.get('YTDLP_LOG_LEVEL', 'WARNING').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.01'))
+
+trace_id_var = contextvars.ContextVar('trace_id', default=None)
+LOG_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'trace_id', 'sample_rate'}
+
+class JsonFormatter(logging.Formatter):
+    """Kaydı tek satır JSON'a çevirir; extra ile verilen alanlar da eklenir"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.trace_id:
+            entry['trace_id'] = record.trace_id
+        entry.update((key, value) for key, value in vars(record).items() if key not in LOG_RECORD_ATTRS)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class LogContextFilter(logging.Filter):
+    """Çağıran thread'de trace ID'yi ekler ve sample_rate taşıyan kayıtları örnekler"""
+
+    def filter(self, record):
+        record.trace_id = getattr(record, 'trace_id', None) or trace_id_var.get()
+        sample_rate = getattr(record, 'sample_rate', None)
+        return sample_rate is None or random.random() < sample_rate
+
+class YtDlpLogger:
+    """yt-dlp çıktısını 'video_downloader.ytdlp' logger'ına yönlendirir"""
+
+    def __init__(self):
+        self.logger = logging.getLogger('video_downloader.ytdlp')
+
+    def debug(self, msg):
+        # yt-dlp bilgi mesajlarını da debug() ile gönderir; gerçek debug mesajları '[debug] ' ile başlar
+        if msg.startswith('[debug] '):
+            self.logger.debug(msg[len('[debug] '):])
+        else:
+            self.logger.info(msg)
+
+    def info(self, msg):
+        self.logger.info(msg)
+
+    def warning(self, msg):
+        self.logger.warning(msg)
+
+    def error(self, msg):
+        self.logger.error(msg)
+
+def setup_logging():
+    """Kuyruk tabanlı handler'ı kur; dinleyici thread fork sonrası yeniden başlatılır"""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(LogContextFilter())
+    logger = logging.getLogger('video_downloader')
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
+    logging.getLogger('video_downloader.ytdlp').setLevel(YTDLP_LOG_LEVEL)
+    
+    def restart_listener():
+        # gunicorn --preload: thread'ler fork'la taşınmaz
+        listener._thread = None
+        listener.start()
+    
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=restart_listener)
+    return logger
+
+log = setup_logging()
+ytdlp_logger = YtDlpLogger()
 
-print("[DEBUG] Starting app initialization...", file=sys.stderr)
+log.debug("Starting app initialization...")
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 app.config['MAX_CONTENT_LENGTH'] = 1 * 1024 * 1024  # 1MB max cookie file
 
+# ============ State Store ============
+# gunicorn birden fazla worker ile çalıştığında durum tüm süreçlerde ortak olmalı.
+# STATE_BACKEND=memory (varsayılan, tek süreç), sqlite (WAL, süreçler arası paylaşım)
+# veya redis (makineler arası paylaşım, redis paketi gerekir)
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+STATE_DB_PATH = os.environ.get('STATE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state.db'))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+class MemoryStateStore:
+    """Süreç içi dict tabanlı durum deposu"""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def pop(self, key, default=None):
+        return self.data.pop(key, default)
+
+    def items(self):
+        return list(self.data.items())
+
+    def patch(self, key, **fields):
+        """Kaydın alanlarını güncelle; kayıt yoksa None döndür"""
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                return None
+            value.update(fields)
+            return value
+
+    def update(self, key, fn):
+        """fn(eski değer veya None) sonucunu atomik olarak yaz; None dönerse kaydı sil"""
+        with self.lock:
+            value = fn(self.data.get(key))
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+            return value
+
+class SQLiteStateStore:
+    """Birden fazla sürecin paylaştığı SQLite (WAL) tabanlı durum deposu"""
+
+    def __init__(self, namespace, path):
+        self.namespace = namespace
+        self.path = path
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (namespace, key))'
+            )
+
+    def _connect(self):
+        # Bağlantılar thread başına açılır; fork sonrası (gunicorn --preload) yeniden açılır
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM state WHERE namespace = ? AND key = ?', (self.namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)',
+            (self.namespace, key, json.dumps(value))
+        )
+
+    def __delitem__(self, key):
+        if self.pop(key) is None:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._connect().execute(
+            'SELECT 1 FROM state WHERE namespace = ? AND key = ?', (self.namespace, key)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM state WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+    def pop(self, key, default=None):
+        conn = self._connect()
+        with self._transaction(conn):
+            value = self.get(key)
+            conn.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (self.namespace, key))
+        return default if value is None else value
+
+    def items(self):
+        rows = self._connect().execute(
+            'SELECT key, value FROM state WHERE namespace = ?', (self.namespace,)
+        ).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def patch(self, key, **fields):
+        """Kaydın alanlarını tek transaction içinde güncelle; kayıt yoksa None döndür"""
+        conn = self._connect()
+        with self._transaction(conn):
+            value = self.get(key)
+            if value is None:
+                return None
+            value.update(fields)
+            self[key] = value
+        return value
+
+    def update(self, key, fn):
+        """fn(eski değer veya None) sonucunu tek transaction içinde yaz; None dönerse kaydı sil"""
+        conn = self._connect()
+        with self._transaction(conn):
+            value = fn(self.get(key))
+            if value is None:
+                conn.execute('DELETE FROM state WHERE namespace = ? AND key = ?', (self.namespace, key))
+            else:
+                self[key] = value
+        return value
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _transaction(conn):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+class RedisStateStore:
+    """Birden fazla makinenin paylaştığı Redis tabanlı durum deposu (kayıt başına bir anahtar)"""
+
+    def __init__(self, namespace, url):
+        import redis  # yalnızca bu backend seçildiğinde gerekli
+        self.namespace = namespace
+        self.prefix = f'vd:state:{namespace}:'
+        self.client = redis.Redis.from_url(url)
+        self.watch_error = redis.WatchError
+
+    def get(self, key, default=None):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else default
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value))
+
+    def __delitem__(self, key):
+        if not self.client.delete(self.prefix + key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return bool(self.client.exists(self.prefix + key))
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+    def pop(self, key, default=None):
+        with self.client.pipeline() as pipe:
+            pipe.get(self.prefix + key)
+            pipe.delete(self.prefix + key)
+            value, _ = pipe.execute()
+        return default if value is None else json.loads(value)
+
+    def items(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        values = self.client.mget(keys) if keys else []
+        return [(key.decode()[len(self.prefix):], json.loads(value))
+                for key, value in zip(keys, values) if value is not None]
+
+    def patch(self, key, **fields):
+        """Kaydın alanlarını WATCH/MULTI ile güncelle; kayıt yoksa None döndür"""
+        def apply(value):
+            if value is not None:
+                value.update(fields)
+            return value
+        return self.update(key, apply)
+
+    def update(self, key, fn):
+        """fn(eski değer veya None) sonucunu WATCH/MULTI ile yaz; None dönerse kaydı sil"""
+        name = self.prefix + key
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    raw = pipe.get(name)
+                    value = fn(json.loads(raw) if raw is not None else None)
+                    pipe.multi()
+                    if value is None:
+                        pipe.delete(name)
+                    else:
+                        pipe.set(name, json.dumps(value))
+                    pipe.execute()
+                    return value
+                except self.watch_error:
+                    # Kayıt arada değişti; en güncel değerle tekrar dene
+                    continue
+
+def create_state_store(namespace):
+    """Yapılandırılmış backend için durum deposu oluştur"""
+    if STATE_BACKEND == 'sqlite':
+        return SQLiteStateStore(namespace, STATE_DB_PATH)
+    if STATE_BACKEND == 'redis':
+        return RedisStateStore(namespace, REDIS_URL)
+    return MemoryStateStore(namespace)
+
+log.debug(f"State backend: {STATE_BACKEND}")
+
+# ============ Expiry Janitor ============
+# Pairing kodları, iş kayıtları ve önbellek süre dolumları tek bir heap'te tutulur; tek bir
+# thread yalnızca süresi dolan kayıtlar için uyanır (istek başına tam tarama yapılmaz).
+JOB_RECORD_TTL = 3600  # 1 saat
+
+class ExpiryJanitor:
+    """Süre dolumlarını zamana göre sıralı heap'te tutan arka plan temizleyicisi"""
+
+    def __init__(self):
+        self.heap = []  # (deadline, seq, callback, args)
+        self.seq = itertools.count()
+        self.lock = threading.Condition()
+        self.thread = None
+        self.counters = {'scheduled': 0, 'expired': 0}
+
+    def _ensure_thread(self):
+        # İlk kayıtta başlatılır (gunicorn --preload fork'undan sonra)
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def schedule(self, delay, callback, *args):
+        """delay saniye sonra callback(*args) çalıştır"""
+        with self.lock:
+            self._ensure_thread()
+            heapq.heappush(self.heap, (time.time() + delay, next(self.seq), callback, args))
+            self.counters['scheduled'] += 1
+            self.lock.notify()
+
+    def expire(self, store, key, ttl, is_active=None):
+        """Kaydı created_at + ttl anında depodan sil; is_active(kayıt) doğruysa silme işlemi ertelenir"""
+        self.schedule(ttl, expire_record, store, key, ttl, is_active)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.heap or self.heap[0][0] > time.time():
+                    self.lock.wait(self.heap[0][0] - time.time() if self.heap else None)
+                _, _, callback, args = heapq.heappop(self.heap)
+                self.counters['expired'] += 1
+            try:
+                callback(*args)
+            except Exception:
+                log.exception("Janitor callback failed")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=len(self.heap))
+
+def expire_record(store, key, ttl, is_active=None):
+    """Kayıt hâlâ süresi dolmuş haliyle duruyorsa sil (aynı anahtarla yenisi yazılmışsa dokunma)"""
+    record = store.get(key)
+    if record is None or time.time() - record.get('created_at', 0) < ttl:
+        return
+    if is_active and is_active(record):
+        # Süren işin kaydı silinirse durum güncellemeleri kaybolur; bitene kadar ertele
+        janitor.schedule(ttl, expire_record, store, key, ttl, is_active)
+        return
+    store.pop(key)
+
+janitor = ExpiryJanitor()
+
+# ============ Metrics ============
+# /metrics için Prometheus metin formatında sayaç ve histogramlar.
+# Değerler süreç başınadır; çok worker'lı kurulumda her worker ayrı raporlar.
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+THROUGHPUT_BUCKETS = (64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+
+def format_metric_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+class Counter:
+    """Etiketli, sadece artan sayaç"""
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_metric_labels(key)} {value}')
+        return lines
+
+class Histogram:
+    """Etiketli, sabit kovalı histogram"""
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}  # labels -> [kova sayıları, toplam, adet]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{format_metric_labels(key + (("le", bound),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{format_metric_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_sum{format_metric_labels(key)} {total}')
+                lines.append(f'{self.name}_count{format_metric_labels(key)} {count}')
+        return lines
+
+METRICS = {
+    'extraction': Histogram('vd_extraction_duration_seconds', 'yt-dlp metadata extraction latency (cache misses)'),
+    'download': Histogram('vd_download_duration_seconds', 'Job start until all media bytes are downloaded'),
+    'postprocess': Histogram('vd_postprocess_duration_seconds', 'Merge/postprocess time after the download phase'),
+    'throughput': Histogram('vd_download_bytes_per_second', 'Average download throughput per job', THROUGHPUT_BUCKETS),
+    'request': Histogram('vd_http_request_duration_seconds', 'End-to-end latency of expensive API endpoints'),
+    'jobs': Counter('vd_jobs_total', 'Finished download jobs by result'),
+    'remux': Counter('vd_remux_plans_total', 'Merge plans chosen by the remux planner'),
+}
+
 # ============ Extension Token Management ============
 # Pairing tokens: geçici kodlar (10 dakika TTL)
 # {pairing_code: {'user_session_id': str, 'created_at': float}}
-pairing_tokens = {}
+pairing_tokens = create_state_store('pairing_tokens')
+
+# Extension tokens: kalıcı tokenlar
+# {extension_token: {'user_session_id': str, 'browser': str, 'paired_at': float, 'last_sync': float}}
+extension_tokens = create_state_store('extension_tokens')
+
+# İkincil indeksler: session başına kayıtlar, tam tarama yapmadan bulunur
+# {user_session_id: pairing_code}
+session_pairing_codes = create_state_store('session_pairing_codes')
+# {user_session_id: {token_prefix: extension_token}}
+session_extensions = create_state_store('session_extensions')
+
+# Sabitler
+PAIRING_TOKEN_TTL = 600  # 10 dakika
+TOKEN_PREFIX_LENGTH = 12  # kullanıcıya gösterilen token öneki ('ext_xxxxxxxx...')
+
+def generate_pairing_code():
+    """6 haneli alfanumerik pairing kodu üret"""
+    chars = string.ascii_uppercase + string.digits
+    # Karışıklığı önlemek için benzer karakterleri çıkar (0, O, I, 1, L)
+    chars = chars.replace('0', '').replace('O', '').replace('I', '').replace('1', '').replace('L', '')
+    return ''.join(random.choices(chars, k=6))
+
+def generate_extension_token():
+    """Güvenli extension token üret"""
+    return f"ext_{secrets.token_urlsafe(32)}"
+
+class TokenRegistry:
+    """Pairing kodları ve extension token'ları; session indeksleriyle birlikte güncellenir"""
+
+    def create_pairing_code(self, user_session_id):
+        """Session'ın önceki kodunu geçersiz kılıp yeni pairing kodu oluştur"""
+        pairing_code = generate_pairing_code()
+        old_code = session_pairing_codes.get(user_session_id)
+        if old_code:
+            pairing_tokens.pop(old_code)
+        pairing_tokens[pairing_code] = {
+            'user_session_id': user_session_id,
+            'created_at': time.time()
+        }
+        session_pairing_codes[user_session_id] = pairing_code
+        janitor.schedule(PAIRING_TOKEN_TTL, self.expire_pairing_code, pairing_code)
+        return pairing_code
+
+    def consume_pairing_code(self, pairing_code):
+        """Kodu tek kullanımlık olarak tüket; geçersiz veya süresi dolmuşsa None"""
+        token_data = pairing_tokens.pop(pairing_code)
+        if token_data is None:
+            return None
+        self._unindex_pairing_code(token_data['user_session_id'], pairing_code)
+        if time.time() - token_data['created_at'] > PAIRING_TOKEN_TTL:
+            return None
+        return token_data
+
+    def expire_pairing_code(self, pairing_code):
+        token_data = pairing_tokens.get(pairing_code)
+        if token_data and time.time() - token_data['created_at'] >= PAIRING_TOKEN_TTL:
+            pairing_tokens.pop(pairing_code)
+            self._unindex_pairing_code(token_data['user_session_id'], pairing_code)
+            return True
+        return False
+
+    def _unindex_pairing_code(self, user_session_id, pairing_code):
+        # İndeks bu arada daha yeni bir koda geçtiyse dokunma
+        session_pairing_codes.update(
+            user_session_id, lambda code: None if code == pairing_code else code)
+
+    def add_extension(self, user_session_id, browser):
+        ext_token = generate_extension_token()
+        extension_tokens[ext_token] = {
+            'user_session_id': user_session_id,
+            'browser': browser,
+            'paired_at': time.time(),
+            'last_sync': None
+        }
+        
+        def index(tokens):
+            tokens = tokens or {}
+            tokens[ext_token[:TOKEN_PREFIX_LENGTH]] = ext_token
+            return tokens
+        
+        session_extensions.update(user_session_id, index)
+        return ext_token
+
+    def list_extensions(self, user_session_id):
+        """Session'a bağlı [(token, kayıt), ...] listesi"""
+        connected = []
+        for ext_token in (session_extensions.get(user_session_id) or {}).values():
+            data = extension_tokens.get(ext_token)
+            if data is not None:
+                connected.append((ext_token, data))
+        return connected
+
+    def find_by_prefix(self, user_session_id, token_prefix):
+        """Session'ın token'ları içinde öneke uyan token'ı bul"""
+        tokens = session_extensions.get(user_session_id) or {}
+        if token_prefix in tokens:
+            return tokens[token_prefix]
+        for prefix, ext_token in tokens.items():
+            if ext_token.startswith(token_prefix):
+                return ext_token
+        return None
+
+    def revoke(self, user_session_id, ext_token):
+        extension_tokens.pop(ext_token)
+        
+        def unindex(tokens):
+            tokens = {prefix: token for prefix, token in (tokens or {}).items() if token != ext_token}
+            return tokens or None
+        
+        session_extensions.update(user_session_id, unindex)
+
+    def rebuild_indexes(self):
+        """İndeksler öncesinden kalan kalıcı (sqlite) token'lar için indeksleri bir kez oluştur"""
+        for ext_token, data in extension_tokens.items():
+            session_extensions.update(
+                data['user_session_id'],
+                lambda tokens: dict(tokens or {}, **{ext_token[:TOKEN_PREFIX_LENGTH]: ext_token}))
+
+token_registry = TokenRegistry()
+if len(extension_tokens) and not len(session_extensions):
+    token_registry.rebuild_indexes()
+
+def cleanup_expired_tokens():
+    """Süresi dolmuş pairing token'ları temizle (janitor'ın kaçırdıkları için, /cleanup)"""
+    expired = [code for code, _ in pairing_tokens.items() if token_registry.expire_pairing_code(code)]
+    return len(expired)
+
+# ============ Rate Limiting ============
+# Token bucket: anahtar başına sabit boyutlu kayıt {'tokens', 'updated'}; dolu kovaya ulaşacak
+# kadar boşta kalan anahtarlar periyodik olarak silinir (boşta anahtar = dolu kova).
+# Limitler "istek/saniye" biçiminde env ile ayarlanır, 0 limiti kapatır.
+RATE_LIMIT_KEY = os.environ.get('RATE_LIMIT_KEY', 'session')  # session | ip
+# Yeni session ID ücretsiz alınabildiği için session modunda IP de bu kat kadar geniş bir limitle sayılır
+RATE_LIMIT_IP_MULTIPLIER = int(os.environ.get('RATE_LIMIT_IP_MULTIPLIER', '5'))
+
+# {'<limiter>:<client>': {'tokens': float, 'updated': float}}
+rate_limits = create_state_store('rate_limits')
+
+def parse_rate_limit(value):
+    """'30/60' -> (30, 60.0)"""
+    limit, _, window = value.partition('/')
+    window = float(window or 60)
+    if window <= 0:
+        raise ValueError(f'Geçersiz rate limit: {value} (pencere 0\'dan büyük olmalı)')
+    return int(limit), window
+
+class TokenBucketLimiter:
+    """Kova kapasitesi = limit, doluş hızı = limit / pencere"""
+
+    def __init__(self, name, limit, window, store):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window if window else 0
+        self.store = store
+        self.next_sweep = time.time() + window
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    def policy(self):
+        return f'{self.limit};w={int(self.window)}'
+
+    def hit(self, client_key):
+        """İsteği say; (izin, kalan, dolma süresi, retry_after) döndür"""
+        now = time.time()
+        result = {}
+        
+        def take(bucket):
+            tokens = self.limit
+            if bucket:
+                tokens = min(self.limit, bucket['tokens'] + (now - bucket['updated']) * self.rate)
+            result['allowed'] = tokens >= 1
+            if result['allowed']:
+                tokens -= 1
+            result['tokens'] = tokens
+            return {'tokens': tokens, 'updated': now}
+        
+        self.store.update(f'{self.name}:{client_key}', take)
+        self.maybe_sweep(now)
+        
+        tokens = result['tokens']
+        reset = math.ceil((self.limit - tokens) / self.rate)
+        retry_after = 0 if result['allowed'] else math.ceil((1 - tokens) / self.rate)
+        return result['allowed'], int(tokens), reset, retry_after
+
+    def headers(self, remaining, reset, retry_after=0):
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(remaining),
+            'RateLimit-Reset': str(reset),
+            'RateLimit-Policy': self.policy(),
+        }
+        if retry_after:
+            headers['Retry-After'] = str(retry_after)
+        return headers
+
+    def forget(self, client_key):
+        self.store.pop(f'{self.name}:{client_key}')
+
+    def maybe_sweep(self, now):
+        """Pencere başına bir kez, kovası tamamen dolmuş anahtarları sil"""
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + self.window
+        prefix = f'{self.name}:'
+        for key, bucket in self.store.items():
+            if key.startswith(prefix) and now - bucket['updated'] >= self.window:
+                self.store.pop(key)
+
+def create_rate_limiter(name, env_name, default, multiplier=1):
+    limit, window = parse_rate_limit(os.environ.get(env_name, default))
+    return TokenBucketLimiter(name, limit * multiplier, window, rate_limits)
+
+# Extension cookie push: token başına dakikada 2 istek
+push_cookies_limiter = create_rate_limiter('push_cookies', 'RATE_LIMIT_PUSH_COOKIES', '2/60')
+# Pahalı endpoint'ler: istemci (session veya IP) başına
+RATE_LIMIT_RULES = {
+    'get_info': ('info', 'RATE_LIMIT_INFO', '30/60'),
+    'start_download': ('download', 'RATE_LIMIT_DOWNLOAD', '10/60'),
+    # Tek istek BATCH_MAX_ENTRIES kadar indirme başlatabilir
+    'start_batch': ('batch', 'RATE_LIMIT_BATCH', '2/60'),
+}
+RATE_LIMITED_ENDPOINTS = {
+    endpoint: create_rate_limiter(*rule) for endpoint, rule in RATE_LIMIT_RULES.items()
+}
+IP_RATE_LIMITED_ENDPOINTS = {
+    endpoint: create_rate_limiter(f'{name}_ip', env_name, default, RATE_LIMIT_IP_MULTIPLIER)
+    for endpoint, (name, env_name, default) in RATE_LIMIT_RULES.items()
+}
+
+def get_rate_limit_client():
+    """Limit anahtarı: yapılandırmaya göre session ID veya istemci IP'si"""
+    if RATE_LIMIT_KEY == 'session' and session.get('session_id'):
+        return session['session_id']
+    return request.remote_addr
+
+def get_rate_limiters():
+    """İsteğe uygulanacak (limiter, anahtar) çiftleri"""
+    limiter = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if not limiter or not limiter.enabled:
+        return []
+    client = get_rate_limit_client()
+    limiters = [(limiter, client)]
+    if client != request.remote_addr:
+        limiters.append((IP_RATE_LIMITED_ENDPOINTS[request.endpoint], request.remote_addr))
+    return limiters
+
+def rate_limit_response(retry_after):
+    """429 yanıtı; RateLimit-* ve Retry-After header'ları after_request'te eklenir"""
+    return jsonify({
+        'error': 'Rate limit aşıldı. Lütfen bekleyin.',
+        'retry_after': retry_after
+    }), 429
+
+def cookies_to_netscape(cookies):
+    """JSON cookie array'ini Netscape formatına çevir"""
+    lines = ["# Netscape HTTP Cookie File", "# https://curl.haxx.se/rfc/cookie_spec.html", "# This file was generated by Video Downloader Extension", ""]
+    
+    for cookie in cookies:
+        domain = cookie.get('domain', '')
+        # Domain başında nokta yoksa ekle (subdomain eşleşmesi için)
+        if domain and not domain.startswith('.'):
+            domain = '.' + domain
+        
+        flag = 'TRUE' if domain.startswith('.') else 'FALSE'
+        path = cookie.get('path', '/')
+        secure = 'TRUE' if cookie.get('secure', False) else 'FALSE'
+        
+        # Expiration: -1 veya None ise session cookie, 0 yapabiliriz
+        expiration = cookie.get('expirationDate', 0)
+        if expiration is None or expiration < 0:
+            expiration = 0
+        else:
+            expiration = int(expiration)
+        
+        name = cookie.get('name', '')
+        value = cookie.get('value', '')
+        
+        if name and domain:
+            line = f"{domain}\t{flag}\t{path}\t{secure}\t{expiration}\t{name}\t{value}"
+            lines.append(line)
+    
+    return '\n'.join(lines)
+
+# Download klasörü
+DOWNLOAD_FOLDER = os.environ.get('DOWNLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads'))
+try:
+    if not os.path.exists(DOWNLOAD_FOLDER):
+        os.makedirs(DOWNLOAD_FOLDER)
+except Exception as e:
+    log.warning(f"Could not create downloads folder: {e}")
+
+# Cookie dosyası klasörü
+COOKIE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cookies')
+try:
+    if not os.path.exists(COOKIE_FOLDER):
+        os.makedirs(COOKIE_FOLDER)
+except Exception as e:
+    log.warning(f"Could not create cookies folder: {e}")
+
+# ============ Cookie Store ============
+# Aynı cookie seti tekrar gönderildiğinde dosya yeniden yazılmaz (içerik hash'i = ETag),
+# yazmalar geçici dosya + rename ile atomiktir ve ayrıştırılmış cookie jar'ı süreç içinde
+# dosyanın mtime/boyutuna göre önbelleğe alınır; yt-dlp her işte dosyayı yeniden okumaz.
+COOKIE_JAR_CACHE_SIZE = int(os.environ.get('COOKIE_JAR_CACHE_SIZE', '256'))
+
+def normalize_cookie(cookie):
+    """Extension cookie'sini Netscape dosyasına yazılan alanlara indir; geçersizse None"""
+    domain = cookie.get('domain', '')
+    name = cookie.get('name', '')
+    if not domain or not name:
+        return None
+    if not domain.startswith('.'):
+        domain = '.' + domain
+    expiration = cookie.get('expirationDate') or 0
+    return {
+        'domain': domain,
+        'path': cookie.get('path') or '/',
+        'secure': bool(cookie.get('secure', False)),
+        'expirationDate': max(int(expiration), 0),
+        'name': name,
+        'value': cookie.get('value', ''),
+    }
+
+def get_cookie_key(cookie):
+    """(domain, path, name) üçlüsü; domain normalize edilir"""
+    domain = cookie.get('domain', '')
+    if domain and not domain.startswith('.'):
+        domain = '.' + domain
+    return f"{domain}\t{cookie.get('path') or '/'}\t{cookie.get('name', '')}"
+
+def netscape_to_cookies(content):
+    """Netscape cookie dosyasını normalize cookie listesine çevir"""
+    cookies = []
+    for line in content.splitlines():
+        if line.startswith('#HttpOnly_'):
+            line = line[len('#HttpOnly_'):]
+        fields = line.split('\t')
+        if line.startswith('#') or len(fields) != 7:
+            continue
+        domain, _, path, secure, expiration, name, value = fields
+        cookie = normalize_cookie({
+            'domain': domain, 'path': path, 'secure': secure == 'TRUE',
+            'expirationDate': int(float(expiration or 0)), 'name': name, 'value': value
+        })
+        if cookie:
+            cookies.append(cookie)
+    return cookies
+
+class CookieStore:
+    """Session başına cookie dosyaları, içerik ETag'leri ve ayrıştırılmış jar önbelleği"""
+
+    def __init__(self, folder, max_jars):
+        self.folder = folder
+        self.max_jars = max_jars
+        self.etags = create_state_store('cookie_etags')  # session_id -> içerik hash'i
+        self.jars = OrderedDict()  # path -> (mtime_ns, size, jar)
+        self.lock = threading.Lock()
+        self.counters = {'writes': 0, 'unchanged': 0, 'jar_hits': 0, 'jar_loads': 0}
+
+    def path(self, session_id):
+        return os.path.join(self.folder, f'{session_id}.txt')
+
+    def etag(self, session_id):
+        """Mevcut cookie setinin ETag'i; dosya yoksa None"""
+        if not os.path.exists(self.path(session_id)):
+            return None
+        return self.etags.get(session_id)
+
+    def write_content(self, session_id, content):
+        """İçerik değiştiyse atomik olarak yaz; (etag, changed) döndür"""
+        with self.lock:
+            return self._write_content(session_id, content)
+
+    def _write_content(self, session_id, content):
+        # self.lock tutulurken çağrılır
+        etag = hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+        path = self.path(session_id)
+        if etag == self.etag(session_id):
+            self.counters['unchanged'] += 1
+            return etag, False
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+        self.etags[session_id] = etag
+        self.counters['writes'] += 1
+        return etag, True
+
+    def replace(self, session_id, cookies):
+        """Tüm cookie setini yaz; (etag, changed, cookie sayısı) döndür.
+
+        Aynı anahtarlı cookie'lerden sonuncusu geçerlidir.
+        """
+        with self.lock:
+            return self._replace(session_id, cookies)
+
+    def _replace(self, session_id, cookies):
+        # self.lock tutulurken çağrılır
+        by_key = {}
+        for cookie in filter(None, map(normalize_cookie, cookies)):
+            by_key[get_cookie_key(cookie)] = cookie
+        ordered = [by_key[key] for key in sorted(by_key)]
+        return self._write_content(session_id, cookies_to_netscape(ordered)) + (len(ordered),)
+
+    def apply_delta(self, session_id, base_etag, upsert, remove):
+        """Değişen cookie'leri mevcut sete uygula; base_etag güncel değilse None döndür.
+
+        Kontrol, okuma ve yazma tek kilit altında yapılır; aynı tabana karşı gelen iki delta'dan
+        ikincisi 412 alır, birincinin değişikliklerini ezmez.
+        """
+        with self.lock:
+            if not base_etag or base_etag != self.etag(session_id):
+                return None
+            with open(self.path(session_id), encoding='utf-8') as f:
+                current = netscape_to_cookies(f.read())
+            removed = {get_cookie_key(cookie) for cookie in remove}
+            cookies = [cookie for cookie in current if get_cookie_key(cookie) not in removed]
+            return self._replace(session_id, cookies + list(upsert))
+
+    def delete(self, session_id):
+        path = self.path(session_id)
+        if os.path.exists(path):
+            os.remove(path)
+        self.etags.pop(session_id)
+
+    def _source_jar(self, cookie_file):
+        """Ayrıştırılmış jar (dosya değiştiyse yeniden ayrıştırılır); değiştirilmemeli"""
+        stat = os.stat(cookie_file)
+        with self.lock:
+            cached = self.jars.get(cookie_file)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.jars.move_to_end(cookie_file)
+                self.counters['jar_hits'] += 1
+                source = cached[2]
+            else:
+                source = YoutubeDLCookieJar(cookie_file)
+                source.load()
+                self.jars[cookie_file] = (stat.st_mtime_ns, stat.st_size, source)
+                self.counters['jar_loads'] += 1
+                while len(self.jars) > self.max_jars:
+                    self.jars.popitem(last=False)
+        return source
+
+    def load_jar(self, cookie_file):
+        """Önbellekteki jar'ın iş başına kopyası"""
+        jar = YoutubeDLCookieJar(cookie_file)
+        self.refill_jar(jar, cookie_file)
+        return jar
+
+    def refill_jar(self, jar, cookie_file=None):
+        """Jar'ı yerinde sıfırla ve cookie dosyasıyla doldur.
+
+        yt-dlp'nin istek yöneticisi aynı jar nesnesini tuttuğu için değiştirmek yerine temizlenir;
+        sunucuların önceki işte koyduğu cookie'ler sonraki kullanıcıya geçmez.
+        """
+        jar.clear()
+        if cookie_file and os.path.exists(cookie_file):
+            for cookie in self._source_jar(cookie_file):
+                jar.set_cookie(copy.copy(cookie))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, cached_jars=len(self.jars))
+
+cookie_store = CookieStore(COOKIE_FOLDER, COOKIE_JAR_CACHE_SIZE)
+
+def create_ydl(ydl_opts):
+    """YoutubeDL oluştur; cookie dosyası yt-dlp yerine cookie_store önbelleğinden yüklenir.
+
+    cookiefile parametresi kaldırıldığından yt-dlp kapanışta dosyayı yeniden yazmaz.
+    """
+    opts = dict(ydl_opts)
+    cookie_file = opts.pop('cookiefile', None)
+    ydl = yt_dlp.YoutubeDL(opts)
+    if cookie_file:
+        ydl.cookiejar = cookie_store.load_jar(cookie_file)
+    return ydl
+
+# İndirme durumlarını takip etmek için
+download_status = create_state_store('download_status')
+
+# Durum değiştiğinde SSE akışlarını uyandırmak için
+status_changed = threading.Condition()
+
+class StatusNotifier:
+    """Durum değişikliklerini asyncio akışlarına iletir (event loop başına tek uyandırma)"""
+
+    def __init__(self):
+        self.events = {}  # loop -> asyncio.Event
+        self.lock = threading.Lock()
+
+    def notify(self):
+        with self.lock:
+            events = list(self.events.items())
+        for loop, event in events:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, timeout):
+        """Bir sonraki değişikliği ya da timeout'u bekle"""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            event = self.events.get(loop)
+            if event is None or event.is_set():
+                event = self.events[loop] = asyncio.Event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+status_notifier = StatusNotifier()
+
+def update_download_status(download_id, **fields):
+    """İndirme durumunu güncelle ve bekleyen akışları bilgilendir"""
+    value = download_status.patch(download_id, **fields)
+    with status_changed:
+        status_changed.notify_all()
+    status_notifier.notify()
+    return value
+
+def is_download_active(record):
+    """Kuyrukta ya da iniyor; kaydı süresi dolsa da silinmemeli"""
+    return record.get('status') not in ('completed', 'error')
+
+def is_batch_active(record):
+    """Genişletiliyor ya da girdilerinden biri hâlâ sürüyor"""
+    if record.get('status') == 'expanding':
+        return True
+    return record.get('status') != 'error' and any(
+        is_download_active(download_status.get(entry['download_id']) or {'status': 'error'})
+        for entry in record.get('entries', []))
+
+# Bellek temizliği için eski download'ları sil. Normalde kayıtlar janitor ile süresi dolunca
+# silinir; bu tam tarama yalnızca /cleanup ile (ör. başka bir süreçten kalan kayıtlar için) çalışır.
+def cleanup_old_downloads():
+    """1 saatten eski, bitmiş download durumlarını temizle"""
+    current_time = time.time()
+    expired = [did for did, data in download_status.items() 
+               if current_time - data.get('created_at', current_time) > JOB_RECORD_TTL
+               and not is_download_active(data)]
+    for did in expired:
+        download_status.pop(did)
+    for bid, data in batch_jobs.items():
+        if current_time - data.get('created_at', current_time) > JOB_RECORD_TTL and not is_batch_active(data):
+            batch_jobs.pop(bid)
+    return len(expired)
+
+# Ortam tespiti
+IS_SERVER = os.environ.get('RAILWAY_ENVIRONMENT') or os.environ.get('RENDER') or os.environ.get('FLY_APP_NAME')
+
+log.debug(f"IS_SERVER: {IS_SERVER}")
+
+# Platform proxy'si arkasında request.remote_addr proxy'nin adresidir; gerçek istemci IP'si
+# (rate limit ve oturumsuz kullanıcı anahtarı için) güvenilen proxy sayısı kadar X-Forwarded-For'dan alınır
+TRUSTED_PROXY_COUNT = int(os.environ.get('TRUSTED_PROXY_COUNT', '1' if IS_SERVER else '0'))
+if TRUSTED_PROXY_COUNT:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
+
+def get_ydl_opts(cookie_file=None):
+    """yt-dlp ayarları"""
+    opts = {
+        # Çıktı yapılandırılmış logger'a gider; ilerleme progress hook ile izlenir
+        'logger': ytdlp_logger,
+        'verbose': YTDLP_LOG_LEVEL == 'DEBUG',
+        'noprogress': True,
+        'no_warnings': False,
+        'age_limit': None,
+        'cachedir': False,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        }
+    }
+    
+    # Cookie dosyası varsa kullan
+    if cookie_file:
+        if os.path.exists(cookie_file):
+            opts['cookiefile'] = cookie_file
+            log.debug(f"Using cookie file: {cookie_file}")
+        else:
+            log.debug(f"Cookie file path provided but file not found: {cookie_file}")
+    # Yerel ortamda tarayıcı cookie'si kullan
+    elif not IS_SERVER:
+        for browser in ['firefox', 'chrome', 'edge', 'brave']:
+            try:
+                opts['cookiesfrombrowser'] = (browser,)
+                log.debug(f"Using browser cookies: {browser}")
+                break
+            except:
+                continue
+    else:
+        log.debug("No cookie file provided to get_ydl_opts")
+
+    
+    return opts
+
+def sanitize_filename(filename):
+    """Dosya adından geçersiz karakterleri temizle"""
+    return re.sub(r'[<>:"/\\|?*]', '', filename)
+
+# ============ YoutubeDL Pool ============
+# YoutubeDL örnekleri cookie kimliğine göre havuzda tutulur: extractor örnekleri, yüklenmiş
+# cookie jar ve HTTP bağlantı havuzları (TLS oturumları) istekler arasında yeniden kullanılır.
+# Bir örnek aynı anda yalnızca bir thread'e verilir; iş bazlı ayarlar ödünç alırken uygulanır,
+# geri verilince örnek temel ayarlarına döner.
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', '8'))  # toplam boşta örnek sayısı
+YDL_POOL_IDLE_TIMEOUT = int(os.environ.get('YDL_POOL_IDLE_TIMEOUT', '300'))  # saniye
+
+def get_cookie_identity(cookie_file):
+    """Havuz anahtarı ve cookie dosyasının sürümü (değişince örnek yenilenir)"""
+    if cookie_file and os.path.exists(cookie_file):
+        stat = os.stat(cookie_file)
+        return cookie_file, (stat.st_mtime_ns, stat.st_size)
+    return None, None
+
+# apply_ydl_overrides'in yeniden kurduğu YoutubeDL iç alanları; requirements.txt'teki sabit yt-dlp
+# sürümüyle doğrulanmıştır. Başka bir sürümde biri eksikse havuz her iş için yeni örnek oluşturur.
+YDL_REUSE_ATTRIBUTES = ('_parse_outtmpl', 'build_format_selector', 'format_selector', '_progress_hooks',
+                        '_postprocessor_hooks', '_post_hooks', '_pps', '_download_retcode', '_num_downloads')
+
+def apply_ydl_overrides(ydl, overrides):
+    """Oluşturulmuş örneğe iş bazlı ayarları uygula.
+
+    YoutubeDL bazı parametreleri (format seçici, çıktı şablonu, hook'lar) __init__'te
+    işlediğinden bunlar burada yeniden kurulur.
+    """
+    ydl.params.update(overrides)
+    ydl._parse_outtmpl()
+    format_spec = ydl.params.get('format')
+    ydl.format_selector = (
+        format_spec if format_spec in (None, '-') or callable(format_spec)
+        else ydl.build_format_selector(format_spec))
+    ydl._progress_hooks = []
+    ydl._postprocessor_hooks = []
+    ydl._post_hooks = []
+    ydl._pps = {when: [] for when in ydl._pps}
+    for hook in ydl.params.get('progress_hooks', []):
+        ydl.add_progress_hook(hook)
+    ydl._download_retcode = 0
+    ydl._num_downloads = 0
+
+class YdlPool:
+    """Cookie kimliğine göre anahtarlanmış, sınırlı, ısınmış YoutubeDL havuzu"""
+
+    def __init__(self, max_idle, idle_timeout):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = OrderedDict()  # id(ydl) -> {'key', 'version', 'ydl', 'base', 'last_used'} (LRU sırası)
+        self.lock = threading.Lock()
+        self.sweep_scheduled = False
+        self.reuse_supported = None  # ilk ödünç almada YDL_REUSE_ATTRIBUTES ile belirlenir
+        self.counters = {'created': 0, 'reused': 0, 'stale': 0, 'evicted': 0}
+
+    @contextlib.contextmanager
+    def checkout(self, cookie_file=None, overrides=None):
+        """Örneği ödünç al; hata olursa örnek havuza geri konmaz"""
+        key, version = get_cookie_identity(cookie_file)
+        if self.reuse_supported is None:
+            self.reuse_supported = self._check_reuse()
+        if not self.reuse_supported:
+            # Bu yt-dlp sürümünde örnek yeniden kurulamıyor; iş ayarlarıyla yeni örnek
+            ydl = create_ydl(dict(get_ydl_opts(key), **(overrides or {})))
+            with self.lock:
+                self.counters['created'] += 1
+            with contextlib.closing(ydl):
+                yield ydl
+            return
+        
+        entry = self._take(key, version)
+        if entry is None:
+            ydl = create_ydl(get_ydl_opts(key))
+            entry = {'key': key, 'version': version, 'ydl': ydl, 'base': dict(ydl.params)}
+            with self.lock:
+                self.counters['created'] += 1
+        elif not entry['ydl'].params.get('cookiesfrombrowser'):
+            cookie_store.refill_jar(entry['ydl'].cookiejar, key)
+        
+        apply_ydl_overrides(entry['ydl'], overrides or {})
+        try:
+            yield entry['ydl']
+        except BaseException:
+            entry['ydl'].close()
+            raise
+        self._give_back(entry)
+
+    @staticmethod
+    def _check_reuse():
+        with contextlib.closing(yt_dlp.YoutubeDL({'logger': ytdlp_logger})) as ydl:
+            missing = [name for name in YDL_REUSE_ATTRIBUTES if not hasattr(ydl, name)]
+        if missing:
+            log.warning("yt-dlp version does not support instance reuse, pooling disabled",
+                        extra={'yt_dlp_version': yt_dlp.version.__version__, 'missing': missing})
+        return not missing
+
+    def _take(self, key, version):
+        stale = []
+        found = None
+        with self.lock:
+            for ident, entry in reversed(self.idle.items()):
+                if entry['key'] != key:
+                    continue
+                if entry['version'] != version:
+                    stale.append(ident)
+                    continue
+                found = ident
+                break
+            stale = [self.idle.pop(ident) for ident in stale]
+            self.counters['stale'] += len(stale)
+            entry = self.idle.pop(found) if found is not None else None
+            if entry:
+                self.counters['reused'] += 1
+        for old in stale:
+            old['ydl'].close()
+        return entry
+
+    def _give_back(self, entry):
+        ydl = entry['ydl']
+        ydl.params.clear()
+        ydl.params.update(entry['base'])
+        entry['last_used'] = time.time()
+        evicted = []
+        with self.lock:
+            self.idle[id(ydl)] = entry
+            while len(self.idle) > self.max_idle:
+                evicted.append(self.idle.popitem(last=False)[1])
+            self.counters['evicted'] += len(evicted)
+            schedule_sweep = not self.sweep_scheduled
+            self.sweep_scheduled = True
+        for old in evicted:
+            old['ydl'].close()
+        if schedule_sweep:
+            janitor.schedule(self.idle_timeout, self.sweep)
+
+    def sweep(self):
+        """idle_timeout boyunca kullanılmayan örnekleri kapat (bağlantılar da kapanır)"""
+        deadline = time.time() - self.idle_timeout
+        with self.lock:
+            expired = [ident for ident, entry in self.idle.items() if entry['last_used'] <= deadline]
+            expired = [self.idle.pop(ident) for ident in expired]
+            self.counters['evicted'] += len(expired)
+            self.sweep_scheduled = bool(self.idle)
+        for entry in expired:
+            entry['ydl'].close()
+        if self.sweep_scheduled:
+            janitor.schedule(self.idle_timeout, self.sweep)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, idle=len(self.idle), max_idle=self.max_idle,
+                        reuse_supported=self.reuse_supported)
+
+ydl_pool = YdlPool(YDL_POOL_SIZE, YDL_POOL_IDLE_TIMEOUT)
+
+# ============ Metadata Cache ============
+# Aynı video için tekrar tekrar extract_info çalıştırmamak için TTL + LRU önbellek
+METADATA_CACHE_TTL = int(os.environ.get('METADATA_CACHE_TTL', '300'))  # 5 dakika
+METADATA_CACHE_NEGATIVE_TTL = int(os.environ.get('METADATA_CACHE_NEGATIVE_TTL', '60'))  # hatalar için 1 dakika
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get('METADATA_CACHE_MAX_ENTRIES', '256'))
+
+YOUTUBE_ID_PATTERN = re.compile(
+    r'^https?://(?:(?:www|m|music)\.)?(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)'
+    r'([0-9A-Za-z_-]{11})'
+)
+
+def get_canonical_video_key(url):
+    """URL'den önbellek anahtarı üret (youtu.be/X, watch?v=X&t=10 ve shorts/X aynı anahtar)"""
+    match = YOUTUBE_ID_PATTERN.match(url.strip())
+    if match:
+        return f'youtube:{match.group(1)}'
+    return url.strip()
+
+class MetadataCache:
+    """Single-flight birleştirmeli TTL + LRU metadata önbelleği"""
+
+    def __init__(self, max_entries, ttl, negative_ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.entries = OrderedDict()  # key -> {'info', 'error', 'expires_at', 'created_at'}
+        self.in_flight = {}  # key -> {'event', 'info', 'error'}
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'negative_hits': 0, 'coalesced': 0, 'evictions': 0}
+
+    def get(self, key, loader):
+        """Önbellekten döndür, yoksa loader'ı tek sefer çalıştır (eşzamanlı istekler bekler)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['expires_at'] > time.time():
+                self.entries.move_to_end(key)
+                if entry['error'] is not None:
+                    self.counters['negative_hits'] += 1
+                    raise entry['error']
+                self.counters['hits'] += 1
+                return entry['info']
+            if entry:
+                del self.entries[key]
+
+            flight = self.in_flight.get(key)
+            if flight:
+                self.counters['coalesced'] += 1
+                leader = False
+            else:
+                self.counters['misses'] += 1
+                flight = {'event': threading.Event(), 'info': None, 'error': None}
+                self.in_flight[key] = flight
+                leader = True
+
+        if not leader:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['info']
+
+        try:
+            flight['info'] = loader()
+        except Exception as e:
+            flight['error'] = e
+        finally:
+            with self.lock:
+                self._store(key, flight['info'], flight['error'])
+                del self.in_flight[key]
+            flight['event'].set()
+
+        if flight['error'] is not None:
+            raise flight['error']
+        return flight['info']
+
+    def peek(self, key):
+        """Süresi dolmamış başarılı kaydı sayaçları etkilemeden döndür"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry['error'] is None and entry['expires_at'] > time.time():
+                return entry
+        return None
+
+    def _store(self, key, info, error):
+        ttl = self.negative_ttl if error is not None else self.ttl
+        now = time.time()
+        self.entries[key] = {'info': info, 'error': error, 'created_at': now, 'expires_at': now + ttl}
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), in_flight=len(self.in_flight))
+
+metadata_cache = MetadataCache(METADATA_CACHE_MAX_ENTRIES, METADATA_CACHE_TTL, METADATA_CACHE_NEGATIVE_TTL)
+
+def extract_info_raw(url, cookie_file=None):
+    """yt-dlp ile ham info dict'ini çıkar (web sürecinde ya da işçi süreçte çalışır)"""
+    with ydl_pool.checkout(cookie_file, {'extract_flat': False}) as ydl:
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+def extract_video_info(url, cookie_file=None):
+    """Ham yt-dlp info dict'ini önbellek üzerinden al"""
+    # Cookie ile alınan bilgi (yaş kısıtlaması, özel video) başka kullanıcılarla paylaşılmamalı
+    key = (get_canonical_video_key(url), cookie_file)
+
+    def load():
+        with METRICS['extraction'].time():
+            if extraction_pool.enabled:
+                return extraction_pool.run(extract_info_raw, url, cookie_file, timeout=EXTRACTION_TIMEOUT)
+            return extract_info_raw(url, cookie_file)
+
+    return metadata_cache.get(key, load)
+
+INFO_URL_EXPIRY_MARGIN = 300  # imzalı format URL'lerinin bitmesine 5 dakikadan az kaldıysa yeniden çıkar
+
+def get_reusable_info(url, cookie_file=None):
+    """/api/info ile çıkarılmış ve hâlâ geçerli info dict'inin temiz bir kopyasını döndür"""
+    entry = metadata_cache.peek((get_canonical_video_key(url), cookie_file))
+    if not entry:
+        return None
+    
+    # YouTube format URL'leri 'expire' parametresi ile imzalanır
+    deadline = time.time() + INFO_URL_EXPIRY_MARGIN
+    for f in entry['info'].get('formats') or []:
+        expire = re.search(r'[?&/]expire[=/](\d+)', f.get('url') or '')
+        if expire and int(expire.group(1)) < deadline:
+            log.debug("Cached info has expired format URLs, re-extracting")
+            return None
+    
+    # Önbellekteki kaydı bozmamak için seçilmiş format vb. alanları atılmış yeni bir kopya
+    return yt_dlp.YoutubeDL.sanitize_info(entry['info'], remove_private_keys=True)
+
+def get_video_info(url, cookie_file=None):
+    """Video bilgilerini al"""
+    info = extract_video_info(url, cookie_file)
+    
+    # Mevcut formatları logla
+    available_formats = info.get('formats', [])
+    log.debug(f"Available formats count: {len(available_formats)}")
+    for f in available_formats[:5]:  # İlk 5 formatı göster
+        log.debug(f"Format: {f.get('format_id')} - {f.get('ext')} - {f.get('height')}p")
+    
+    formats = [
+        {'format_id': 'best', 'quality': 'En İyi Kalite', 'ext': 'mp4', 'type': 'video+audio'},
+        {'format_id': '1080p', 'quality': '1080p (Full HD)', 'ext': 'mp4', 'type': 'video+audio'},
+        {'format_id': '720p', 'quality': '720p (HD)', 'ext': 'mp4', 'type': 'video+audio'},
+        {'format_id': '480p', 'quality': '480p', 'ext': 'mp4', 'type': 'video+audio'},
+        {'format_id': '360p', 'quality': '360p', 'ext': 'mp4', 'type': 'video+audio'},
+        {'format_id': 'bestaudio', 'quality': 'Sadece Ses (M4A)', 'ext': 'm4a', 'type': 'audio'},
+    ]
+    
+    return {
+        'title': info.get('title', 'Bilinmeyen'),
+        'thumbnail': info.get('thumbnail'),
+        'duration': info.get('duration'),
+        'uploader': info.get('uploader', 'Bilinmeyen'),
+        'view_count': info.get('view_count'),
+        'formats': formats,
+        'age_restricted': (info.get('age_limit') or 0) >= 18
+    }
+
+# ============ Finished File Cache ============
+# Aynı (video, format) çıktısı bir kez indirilir; disk bütçesi aşılınca en eski kullanılan silinir
+FILE_CACHE_MAX_BYTES = int(os.environ.get('FILE_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))  # 2 GB
+# Önbellek ve kota muhasebesi süreç başınadır; DOWNLOAD_FOLDER'ı paylaşan ve indirme yapan süreç
+# sayısı (gunicorn worker'ları ya da kuyruk worker'ları) kadar bölünür ki toplam disk kullanımı
+# yapılandırılan sınırı aşmasın. Varsayılan gunicorn'un da okuduğu WEB_CONCURRENCY'dir.
+STORAGE_PROCESS_COUNT = max(1, int(os.environ.get('STORAGE_PROCESS_COUNT', os.environ.get('WEB_CONCURRENCY', '1'))))
+FILE_UNDELIVERED_GRACE = 3600  # hiç tamamen indirilmemiş dosyalar 1 saat korunur
+
+def get_file_cache_key(url, format_id, clip=None, cookie_file=None):
+    """(video ID, format_id[, kırpma aralığı][, cookie dosyası]) için önbellek anahtarı"""
+    key = (get_canonical_video_key(url), format_id)
+    if clip:
+        key += (json.dumps(clip, sort_keys=True),)
+    # Cookie ile indirilen dosya (yaş kısıtlaması, özel video) başka kullanıcılarla paylaşılmamalı
+    if cookie_file:
+        key += ('cookie:' + cookie_file,)
+    return key
+
+def get_display_filename(filename):
+    """'<prefix>_<başlık>.<ext>' dosya adından kullanıcıya gösterilecek adı çıkar"""
+    return sanitize_filename(filename.split('_', 1)[-1])
+
+class FileCache:
+    """İçerik adresli bitmiş dosya önbelleği ve devam eden indirmelerin paylaşımı"""
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> {'filename', 'size'}
+        self.in_flight = {}  # key -> {'leader': download_id, 'followers': [download_id, ...]}
+        self.pinned = {}  # filename -> gönderimi süren istek sayısı
+        self.adopted = {}  # dosya adı öneki -> önceki süreçten kalan dosyanın ('adopted', filename) anahtarı
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'attached': 0, 'misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def prefix(key):
+        """Anahtar için dosya adı öneki (alt çizgi içermez)"""
+        return hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:16]
+
+    def begin(self, key, download_id):
+        """('hit', filename), ('attached', leader_id) veya ('leader', None) döndür"""
+        with self.lock:
+            entry = self.entries.get(key) or self._claim_adopted(key)
+            if entry and os.path.exists(os.path.join(self.folder, entry['filename'])):
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return 'hit', entry['filename']
+            if entry:
+                self._remove(key)
+
+            flight = self.in_flight.get(key)
+            if flight:
+                flight['followers'].append(download_id)
+                self.counters['attached'] += 1
+                return 'attached', flight['leader']
+
+            self.in_flight[key] = {'leader': download_id, 'followers': []}
+            self.counters['misses'] += 1
+            return 'leader', None
+
+    def complete(self, key, filename):
+        """İndirmeyi önbelleğe kaydet, bekleyen takipçileri döndür"""
+        filepath = os.path.join(self.folder, filename)
+        with self.lock:
+            flight = self.in_flight.pop(key, None)
+            if key in self.entries:
+                self._remove(key)
+            # Aynı dosya başka bir anahtarla (ör. sahiplenilmiş) kayıtlıysa iki kez sayılmasın ve
+            # o kaydın silinmesi bu dosyayı götürmesin
+            duplicate = self._find(filename)
+            if duplicate is not None:
+                self._remove(duplicate)
+            self.entries[key] = {'filename': filename, 'size': os.path.getsize(filepath),
+                                 'created_at': time.time(), 'delivered': False}
+            self.total_bytes += self.entries[key]['size']
+            self._evict(keep=key)
+        # Teslim edilmemiş dosyanın koruması bittiğinde bütçe yeniden kontrol edilir
+        janitor.schedule(FILE_UNDELIVERED_GRACE, self.trim)
+        return flight['followers'] if flight else []
+
+    def trim(self):
+        with self.lock:
+            self._evict()
+
+    def fail(self, key):
+        """Başarısız indirmenin takipçilerini döndür"""
+        with self.lock:
+            flight = self.in_flight.pop(key, None)
+        return flight['followers'] if flight else []
+
+    def _find(self, filename):
+        for key, entry in self.entries.items():
+            if entry['filename'] == filename:
+                return key
+        return None
+
+    def pin(self, filename):
+        """Gönderilen dosyanın silinmesini engelle ve LRU sırasını güncelle"""
+        with self.lock:
+            self.pinned[filename] = self.pinned.get(filename, 0) + 1
+            key = self._find(filename)
+            if key is not None:
+                self.entries.move_to_end(key)
+
+    def mark_delivered(self, filename):
+        """Dosya en az bir kez sonuna kadar gönderildi; artık LRU ile silinebilir"""
+        with self.lock:
+            key = self._find(filename)
+            if key is not None:
+                self.entries[key]['delivered'] = True
+
+    def unpin(self, filename):
+        with self.lock:
+            count = self.pinned.get(filename, 1) - 1
+            if count > 0:
+                self.pinned[filename] = count
+            else:
+                self.pinned.pop(filename, None)
+            self._evict()
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['size']
+        if key[0] == 'adopted':
+            self.adopted.pop(entry['filename'].split('_', 1)[0], None)
+        return entry
+
+    def adopt(self, filename, created_at):
+        """Önceki süreçten kalan dosyayı bütçeye dahil et (LRU ile silinebilir)"""
+        filepath = os.path.join(self.folder, filename)
+        with self.lock:
+            if self._find(filename) is not None:
+                return
+            key = ('adopted', filename)
+            self.entries[key] = {'filename': filename, 'size': os.path.getsize(filepath),
+                                 'created_at': created_at, 'delivered': False}
+            self.total_bytes += self.entries[key]['size']
+            self.entries.move_to_end(key, last=False)
+            self.adopted[filename.split('_', 1)[0]] = key
+
+    def _claim_adopted(self, key):
+        # Sahiplenilen dosyanın adı gerçek anahtarın önekiyle başlar; ilk istekte o anahtara taşı
+        adopted_key = self.adopted.pop(self.prefix(key), None)
+        if adopted_key is None:
+            return None
+        entry = self.entries.pop(adopted_key)
+        self.entries[key] = entry
+        return entry
+
+    def shrink(self, target_bytes):
+        """Silinebilir dosyaları atarak toplamı target_bytes altına indirmeyi dene"""
+        with self.lock:
+            self._evict(limit=target_bytes)
+            return self.total_bytes
+
+    def _evict(self, keep=None, limit=None):
+        # En eski kullanılandan başlayarak bütçe altına inene kadar sil (gönderilenler hariç).
+        # Henüz teslim edilmemiş dosyalar, kullanıcı indirmeye devam edebilsin diye
+        # FILE_UNDELIVERED_GRACE dolana kadar korunur.
+        limit = self.max_bytes if limit is None else limit
+        grace_deadline = time.time() - FILE_UNDELIVERED_GRACE
+        for key in list(self.entries):
+            if self.total_bytes <= limit:
+                break
+            entry = self.entries[key]
+            if key == keep or entry['filename'] in self.pinned:
+                continue
+            if not entry['delivered'] and entry['created_at'] > grace_deadline:
+                continue
+            entry = self._remove(key)
+            self.counters['evictions'] += 1
+            try:
+                os.remove(os.path.join(self.folder, entry['filename']))
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.total_bytes,
+                        max_bytes=self.max_bytes, in_flight=len(self.in_flight))
+
+file_cache = FileCache(DOWNLOAD_FOLDER, FILE_CACHE_MAX_BYTES // STORAGE_PROCESS_COUNT)
+
+# Süren indirmeler tablosu (FileCache.in_flight) süreç başınadır. Çıktı adı önbellek anahtarından
+# türediği için aynı öneki iki süreç (gunicorn worker'ları, kuyruk worker'ları) aynı anda indirirse
+# aynı .part dosyalarına yazar; önek indirme boyunca süreçler arası flock ile sahiplenilir.
+OUTPUT_LOCK_FOLDER = os.path.join(DOWNLOAD_FOLDER, '.locks')
+JOB_RETRY_INTERVAL = int(os.environ.get('JOB_RETRY_INTERVAL', '5'))  # ertelenen iş bu aralıkla yeniden denenir
+
+class JobDeferredError(Exception):
+    """İş şu an başlayamaz; worker tutulmadan JOB_RETRY_INTERVAL sonra yeniden denenmeli"""
+    waiting_for = None
+
+class OutputBusyError(JobDeferredError):
+    """Aynı çıktı başka bir süreçte iniyor; bitince yeniden deneme dosyayı hazır bulur"""
+    waiting_for = 'output'
+
+@contextlib.contextmanager
+def output_lock(file_prefix):
+    """Çıktı önekini süreçler arası sahiplen; başka süreç tutuyorsa OutputBusyError fırlat"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(OUTPUT_LOCK_FOLDER, exist_ok=True)
+    path = os.path.join(OUTPUT_LOCK_FOLDER, f'{file_prefix}.lock')
+    while True:
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise OutputBusyError()
+        # Önceki sahip bırakırken dosyayı sildiyse kilit artık görünmeyen bir dosyada; yeniden aç
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+    try:
+        yield
+    finally:
+        # Kilit tutulurken silinir; bekleyenler yukarıdaki kontrolle yeni dosyaya geçer
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+        os.close(fd)
+
+process_locks = {}  # ad -> fd; süreç ömrü boyunca tutulur (fork edilen çocuklar da paylaşır)
+
+def hold_process_lock(name):
+    """Süreç ömrü boyunca tutulacak kilidi almayı dene; başka süreç tutuyorsa False"""
+    if fcntl is None or name in process_locks:
+        return True
+    os.makedirs(OUTPUT_LOCK_FOLDER, exist_ok=True)
+    fd = os.open(os.path.join(OUTPUT_LOCK_FOLDER, f'{name}.lock'), os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    process_locks[name] = fd
+    return True
+
+# ============ Storage Quota ============
+# İşler başlamadan tahmini boyutları kadar kota ayırır; bütçe dolunca iş kuyrukta bekler,
+# tek başına sığmayacak iş reddedilir. Başlangıçta yarım kalmış ve sahipsiz dosyalar toplanır.
+DOWNLOAD_QUOTA_BYTES = int(os.environ.get('DOWNLOAD_QUOTA_BYTES', str(4 * 1024 * 1024 * 1024)))  # 4 GB
+MIN_FREE_DISK_BYTES = int(os.environ.get('MIN_FREE_DISK_BYTES', str(512 * 1024 * 1024)))  # 512 MB
+DEFAULT_JOB_RESERVATION = int(os.environ.get('DEFAULT_JOB_RESERVATION', str(256 * 1024 * 1024)))
+STORAGE_WAIT_TIMEOUT = int(os.environ.get('STORAGE_WAIT_TIMEOUT', '600'))  # saniye
+STALE_PARTIAL_AGE = 600  # bu kadar süredir yazılmayan .part dosyaları yarım kalmış sayılır
+PARTIAL_FILE_PATTERN = re.compile(r'(\.part|\.ytdl|\.temp|\.part-Frag\d+|\.f\d+\.\w+)$')
+
+FORMAT_MAX_HEIGHTS = {'1080p': 1080, '720p': 720, '480p': 480, '360p': 360}
+
+def estimate_download_size(info, format_id, clip=None):
+    """İndirilecek bayt tahmini (kırpma varsa aralığın payı kadar); bilinmiyorsa None"""
+    if not info:
+        return None
+    size = estimate_full_download_size(info, format_id)
+    span = get_clip_span(info, clip)
+    if size and span and info.get('duration'):
+        # Kırpılan bölüm videonun süresiyle orantılı yer tutar
+        return int(size * min((span[1] - span[0]) / info['duration'], 1))
+    return size
+
+def estimate_full_download_size(info, format_id):
+    formats = info.get('formats') or [info]
+    
+    def size(fmt):
+        return fmt.get('filesize') or fmt.get('filesize_approx') or 0
+    
+    best_audio = max((size(f) for f in formats if f.get('vcodec') == 'none'), default=0)
+    if format_id == 'bestaudio':
+        return best_audio or None
+    
+    max_height = FORMAT_MAX_HEIGHTS.get(format_id)
+    videos = [f for f in formats if f.get('vcodec') not in (None, 'none') and size(f)
+              and (max_height is None or (f.get('height') or 0) <= max_height)]
+    if not videos:
+        return None
+    best = max(videos, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0))
+    if best.get('acodec') == 'none':
+        # Ayrı video + ses birleştirilirken parçalar ve çıktı bir süre birlikte durur
+        return (size(best) + best_audio) * 2
+    return size(best)
+
+class StorageManager:
+    """DOWNLOAD_FOLDER için kota, çalışan işlerin rezervasyonları ve boş disk kontrolü"""
+
+    def __init__(self, folder, quota_bytes, min_free_bytes):
+        self.folder = folder
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.reservations = {}  # download_id -> bayt
+        self.waiting = {}  # download_id -> ilk reddedilen deneme zamanı
+        self.lock = threading.Lock()
+        self.counters = {'admitted': 0, 'waited': 0, 'rejected': 0, 'reclaimed_files': 0, 'reclaimed_bytes': 0}
+
+    def reservation_for(self, info, format_id, clip=None):
+        return estimate_download_size(info, format_id, clip) or DEFAULT_JOB_RESERVATION
+
+    def admission_error(self, nbytes):
+        """İş hiçbir zaman sığamayacaksa hata mesajı döndür"""
+        if nbytes > self.quota_bytes:
+            return 'Dosya boyutu sunucu depolama sınırını aşıyor'
+        if shutil.disk_usage(self.folder).total - self.min_free_bytes < nbytes:
+            return 'Sunucuda yeterli disk alanı yok'
+        return None
+
+    def _fits(self, nbytes):
+        reserved = sum(self.reservations.values())
+        if file_cache.total_bytes + reserved + nbytes > self.quota_bytes:
+            # Önce önbellekteki silinebilir dosyalardan yer aç
+            file_cache.shrink(self.quota_bytes - reserved - nbytes)
+            if file_cache.total_bytes + reserved + nbytes > self.quota_bytes:
+                return False
+        return shutil.disk_usage(self.folder).free - reserved - nbytes >= self.min_free_bytes
+
+    def reserve(self, download_id, nbytes):
+        """Sığıyorsa kota ayır; (ayrıldı mı, ilk reddedilen denemeden beri geçen süre) döndür.
+
+        Beklemez: yer yoksa iş worker'ı tutmadan daha sonra yeniden denenir.
+        """
+        now = time.time()
+        with self.lock:
+            if self._fits(nbytes):
+                self.waiting.pop(download_id, None)
+                self.reservations[download_id] = nbytes
+                self.counters['admitted'] += 1
+                return True, 0
+            if download_id not in self.waiting:
+                self.waiting[download_id] = now
+                self.counters['waited'] += 1
+            waited = now - self.waiting[download_id]
+            if waited >= STORAGE_WAIT_TIMEOUT:
+                del self.waiting[download_id]
+                self.counters['rejected'] += 1
+            return False, waited
+
+    def release(self, download_id):
+        with self.lock:
+            self.reservations.pop(download_id, None)
+
+    def reclaim(self, live_filenames, resumable_prefixes=()):
+        """Yarım kalmış dosyaları ve hiçbir işin kullanmadığı eski çıktıları sil, kalanları önbelleğe al.
+
+        resumable_prefixes ile başlayan parçalar yeniden başlatılacak işlere aittir ve korunur.
+        """
+        now = time.time()
+        with os.scandir(self.folder) as entries:
+            entries = list(entries)
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            age = now - stat.st_mtime
+            if PARTIAL_FILE_PATTERN.search(entry.name):
+                expired = age > STALE_PARTIAL_AGE and entry.name.split('_', 1)[0] not in resumable_prefixes
+            elif entry.name in live_filenames or age <= FILE_UNDELIVERED_GRACE:
+                file_cache.adopt(entry.name, stat.st_mtime)
+                continue
+            else:
+                expired = True
+            if expired:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    continue
+                self.counters['reclaimed_files'] += 1
+                self.counters['reclaimed_bytes'] += stat.st_size
+        # Sahiplenilen dosyaların koruma süresi bitince önbellek bütçesi yeniden kontrol edilir
+        janitor.schedule(FILE_UNDELIVERED_GRACE, file_cache.trim)
+        log.info("Storage reclaimed", extra=dict(self.counters, cached_bytes=file_cache.total_bytes))
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, quota_bytes=self.quota_bytes, reserved_bytes=sum(self.reservations.values()),
+                        waiting=len(self.waiting), cached_bytes=file_cache.total_bytes, free_disk_bytes=shutil.disk_usage(self.folder).free,
+                        process_count=STORAGE_PROCESS_COUNT)
+
+storage = StorageManager(DOWNLOAD_FOLDER, DOWNLOAD_QUOTA_BYTES // STORAGE_PROCESS_COUNT, MIN_FREE_DISK_BYTES)
+
+class StorageQuotaError(Exception):
+    pass
+
+class StorageBusyError(JobDeferredError):
+    """Şu an yer yok"""
+    waiting_for = 'storage'
+
+def admit_download(download_id, nbytes):
+    """İş için kota ayır; yer yoksa StorageBusyError, STORAGE_WAIT_TIMEOUT içinde açılmazsa StorageQuotaError"""
+    error = storage.admission_error(nbytes)
+    if error:
+        raise StorageQuotaError(error)
+    admitted, waited = storage.reserve(download_id, nbytes)
+    if not admitted:
+        if waited >= STORAGE_WAIT_TIMEOUT:
+            raise StorageQuotaError('Depolama alanı açılmadı, lütfen daha sonra tekrar deneyin')
+        raise StorageBusyError()
+    if (download_status.get(download_id) or {}).get('waiting_for'):
+        update_download_status(download_id, waiting_for=None)
+
+# Dosya gönderim modu: direct (gunicorn, sendfile), x-accel (nginx) veya x-sendfile (Apache/lighttpd)
+FILE_DELIVERY_MODE = os.environ.get('FILE_DELIVERY_MODE', 'direct')
+FILE_ACCEL_PREFIX = os.environ.get('FILE_ACCEL_PREFIX', '/protected-downloads/')
+
+class CachedFileReader(io.FileIO):
+    """Açık kaldığı sürece önbellekteki dosyayı silinmeye karşı koruyan dosya nesnesi"""
+
+    def __init__(self, filename, reaches_end=True):
+        super().__init__(os.path.join(DOWNLOAD_FOLDER, filename), 'rb')
+        self.cache_filename = filename
+        self.reaches_end = reaches_end
+        file_cache.pin(filename)
+
+    def close(self):
+        # WSGI sunucusu gönderimi bitirince (ya da bağlantı kopunca) kapatır. Bağlantı
+        # koptuysa close() istisna sürerken çağrılır; bu durumda teslim edilmiş sayılmaz.
+        if not self.closed:
+            if self.reaches_end and sys.exc_info()[0] is None:
+                file_cache.mark_delivered(self.cache_filename)
+            file_cache.unpin(self.cache_filename)
+        super().close()
+
+def iter_file_range(reader, length, chunk_size=64 * 1024):
+    """Dosyanın [konum, konum + length) aralığını parça parça oku"""
+    try:
+        while length > 0:
+            chunk = reader.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        reader.close()
+
+def prepare_file_response(filename, download_name, request_headers, method='GET'):
+    """Dosya yanıtının (status, headers, mimetype, gönderilecek aralık) bilgisini hesapla.
+
+    Gövde gönderilmeyecekse (304, 416, proxy devri, HEAD) aralık None olur. WSGI ve ASGI katmanları
+    aynı Range/If-Range/ETag kurallarını kullanır.
+    """
+    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    stat = os.stat(filepath)
+    size = stat.st_size
+    etag = f'"{stat.st_ino:x}-{size:x}-{stat.st_mtime_ns:x}"'
+    ascii_name = download_name.encode('ascii', 'ignore').decode('ascii').strip() or 'download'
+    
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Content-Disposition': f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(download_name)}",
+        'Cache-Control': 'private, no-transform',
+    }
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    
+    if etag in request_headers.get('If-None-Match', ''):
+        return 304, headers, None, None
+    
+    # Ön proxy modu: dosyayı nginx/Apache göndersin, gunicorn thread'i hemen serbest kalsın
+    if FILE_DELIVERY_MODE in ('x-accel', 'x-sendfile'):
+        if FILE_DELIVERY_MODE == 'x-accel':
+            headers['X-Accel-Redirect'] = FILE_ACCEL_PREFIX + quote(filename)
+        else:
+            headers['X-Sendfile'] = filepath
+        # Aktarım proxy'de; ne zaman biteceğini bilemeyiz, devredildiği an teslim sayılır
+        if method != 'HEAD':
+            file_cache.mark_delivered(filename)
+        return 200, headers, mimetype, None
+    
+    start, end, status = 0, size - 1, 200
+    range_header = request_headers.get('Range')
+    if_range = request_headers.get('If-Range')
+    # If-Range eşleşmiyorsa dosya değişmiş demektir; Range yok sayılıp tamamı gönderilir
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range_header(range_header)
+        if byte_range and len(byte_range.ranges) == 1:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return 416, headers, None, None
+            start, end, status = bounds[0], bounds[1] - 1, 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    
+    headers['Content-Length'] = str(end - start + 1)
+    if method == 'HEAD':
+        # Gövde yok; dosya açılmaz, sabitlenmez ve teslim edilmiş sayılmaz
+        return status, headers, mimetype, None
+    return status, headers, mimetype, (start, end, size)
+
+def send_download_file(filename, download_name):
+    """Range/If-Range, güçlü ETag ve sıfır kopya (sendfile) destekli dosya gönderimi"""
+    status, headers, mimetype, byte_range = prepare_file_response(filename, download_name, request.headers,
+                                                                  request.method)
+    if byte_range is None:
+        return Response(status=status, headers=headers, mimetype=mimetype)
+    
+    start, end, size = byte_range
+    length = end - start + 1
+    reader = CachedFileReader(filename, reaches_end=(end == size - 1))
+    reader.seek(start)
+    
+    # Dosyanın sonuna kadar olan aralıklar wsgi.file_wrapper ile gönderilir;
+    # gunicorn bunu os.sendfile ile çekirdek içinde kopyalar
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    if file_wrapper and end == size - 1:
+        body = file_wrapper(reader, 256 * 1024)
+    else:
+        body = iter_file_range(reader, length)
+    
+    return Response(body, status=status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+# ============ Transfer Tuning ============
+# DASH/HLS parçalarını paralel indir, HTTP isteklerini parçalara böl (YouTube'un bağlantı başına
+# hız kısıtlamasını aşmak için). İsteğe bağlı adaptif mod ölçülen hıza göre bu değerleri ayarlar.
+CONCURRENT_FRAGMENT_DOWNLOADS = int(os.environ.get('CONCURRENT_FRAGMENT_DOWNLOADS', '4'))
+MAX_CONCURRENT_FRAGMENTS = 16
+HTTP_CHUNK_SIZE = int(os.environ.get('HTTP_CHUNK_SIZE', str(10 * 1024 * 1024)))  # 10 MB
+MIN_HTTP_CHUNK_SIZE = 1024 * 1024
+MAX_HTTP_CHUNK_SIZE = 100 * 1024 * 1024
+ADAPTIVE_TRANSFER = os.environ.get('ADAPTIVE_TRANSFER', '').lower() in ('1', 'true', 'yes')
+# aria2c gibi harici indirici; yalnızca sistemde kuruluysa kullanılır
+EXTERNAL_DOWNLOADER = os.environ.get('EXTERNAL_DOWNLOADER', '')
+EXTERNAL_DOWNLOADER_ARGS = {
+    'aria2c': ['-x', '8', '-s', '8', '-k', '1M', '--summary-interval=1'],
+}
+
+def parse_transfer_options(data):
+    """İstekteki iş bazlı aktarım ayarlarını doğrula ve sınırla"""
+    def clamp(value, default, low, high):
+        try:
+            return min(max(int(value), low), high)
+        except (TypeError, ValueError):
+            return default
+    
+    downloader = data.get('downloader') or EXTERNAL_DOWNLOADER
+    if downloader not in EXTERNAL_DOWNLOADER_ARGS or not shutil.which(downloader):
+        downloader = None
+    
+    adaptive = data.get('adaptive')
+    return {
+        'concurrent_fragments': clamp(data.get('concurrent_fragments'), CONCURRENT_FRAGMENT_DOWNLOADS,
+                                      1, MAX_CONCURRENT_FRAGMENTS),
+        'http_chunk_size': clamp(data.get('http_chunk_size'), HTTP_CHUNK_SIZE,
+                                 MIN_HTTP_CHUNK_SIZE, MAX_HTTP_CHUNK_SIZE),
+        'adaptive': ADAPTIVE_TRANSFER if adaptive is None else bool(adaptive),
+        'downloader': downloader,
+    }
+
+def get_transfer_opts(transfer):
+    """Aktarım ayarlarını yt-dlp seçeneklerine çevir"""
+    transfer = transfer or parse_transfer_options({})
+    opts = {
+        'concurrent_fragment_downloads': transfer['concurrent_fragments'],
+        'http_chunk_size': transfer['http_chunk_size'],
+    }
+    downloader = transfer.get('downloader')
+    if downloader:
+        opts['external_downloader'] = {'default': downloader}
+        opts['external_downloader_args'] = {downloader: EXTERNAL_DOWNLOADER_ARGS[downloader]}
+    return opts
+
+class AdaptiveTransferTuner:
+    """progress_hook'ta ölçülen hıza göre parça eşzamanlılığını ve chunk boyutunu ayarlar.
+
+    yt-dlp bu değerleri her format indirmesi başında params'tan okur; ayarlar bu yüzden
+    sıradaki formatta (ör. videodan sonra ses) ve sıradaki parçalı indirmede etkili olur.
+    """
+
+    WINDOW = 3  # saniye
+    THROTTLED_SPEED = 512 * 1024  # bağlantı başına bunun altı kısıtlama belirtisi
+    FAST_SPEED = 8 * 1024 * 1024
+
+    def __init__(self, params, download_id=None):
+        self.params = params
+        self.download_id = download_id
+        self.window_started = time.time()
+        self.samples = []
+        self.last_speed = None
+
+    def hook(self, d):
+        if d['status'] != 'downloading' or not d.get('speed'):
+            return
+        self.samples.append(d['speed'])
+        if time.time() - self.window_started < self.WINDOW:
+            return
+        
+        speed = sum(self.samples) / len(self.samples)
+        self.samples = []
+        self.window_started = time.time()
+        fragments = self.params.get('concurrent_fragment_downloads') or 1
+        chunk_size = self.params.get('http_chunk_size') or HTTP_CHUNK_SIZE
+        per_connection = speed / fragments if d.get('fragment_count') else speed
+        
+        if per_connection < self.THROTTLED_SPEED:
+            # Bağlantılar kısıtlanıyor: daha çok paralel parça, daha küçük istekler
+            if self.last_speed is None or speed > self.last_speed * 1.1:
+                fragments = min(fragments * 2, MAX_CONCURRENT_FRAGMENTS)
+            chunk_size = max(chunk_size // 2, MIN_HTTP_CHUNK_SIZE)
+        elif per_connection > self.FAST_SPEED:
+            # Bağlantılar hızlı: istek başına ek yükü azalt
+            chunk_size = min(chunk_size * 2, MAX_HTTP_CHUNK_SIZE)
+        self.last_speed = speed
+        
+        if (fragments, chunk_size) != (self.params.get('concurrent_fragment_downloads'),
+                                       self.params.get('http_chunk_size')):
+            log.info("Adaptive transfer adjusted", extra={
+                'download_id': self.download_id, 'speed': round(speed),
+                'fragments': fragments, 'chunk_size': chunk_size})
+            self.params['concurrent_fragment_downloads'] = fragments
+            self.params['http_chunk_size'] = chunk_size
+
+# ============ Clip Ranges ============
+# Uzun bir yayının yalnızca bir bölümü isteniyorsa (start/end ya da bölüm adı) yt-dlp'nin
+# download_ranges'ı ile sadece o aralığın parçaları indirilir ve birleştirilir (ffmpeg gerekir).
+# İş başına tek çıktı dosyası olduğundan istek başına tek aralık ya da tek bölüm seçilir.
+
+def parse_timestamp(value):
+    """Saniye (sayı) ya da '1:02:03.5' biçimindeki zamanı saniyeye çevir"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        seconds = yt_dlp.utils.parse_duration(str(value))
+    if seconds is None or seconds < 0 or math.isinf(seconds):
+        raise ValueError(f'Geçersiz zaman: {value}')
+    return seconds
+
+def parse_clip_options(data):
+    """İstekteki start/end ya da chapter alanlarını doğrula; kırpma istenmediyse None"""
+    start, end, chapter = data.get('start'), data.get('end'), data.get('chapter')
+    if start in (None, '') and end in (None, '') and not chapter:
+        return None
+    if chapter and (start not in (None, '') or end not in (None, '')):
+        raise ValueError('start/end ile chapter birlikte kullanılamaz')
+    
+    clip = {'precise': bool(data.get('precise_cut'))}
+    if chapter:
+        clip['chapter'] = str(chapter)
+        return clip
+    clip['start'] = parse_timestamp(start) if start not in (None, '') else 0
+    clip['end'] = parse_timestamp(end) if end not in (None, '') else None  # None = sonuna kadar
+    if clip['end'] is not None and clip['end'] <= clip['start']:
+        raise ValueError('Bitiş zamanı başlangıçtan sonra olmalı')
+    return clip
+
+def get_chapter_pattern(name):
+    # Bölüm adı birebir (büyük/küçük harf duyarsız) eşleşmeli; birden fazla dosya oluşmasın
+    return rf'(?i)^\s*{re.escape(name.strip())}\s*$'
+
+def get_clip_span(info, clip):
+    """Kırpılacak (başlangıç, bitiş) saniyesi; bilinmiyorsa None"""
+    if not clip or not info:
+        return None
+    if 'chapter' in clip:
+        pattern = get_chapter_pattern(clip['chapter'])
+        for chapter in info.get('chapters') or []:
+            if re.search(pattern, chapter.get('title') or ''):
+                return chapter['start_time'], chapter['end_time']
+        return None
+    end = clip['end'] if clip['end'] is not None else (info.get('duration') or math.inf)
+    return clip['start'], end
+
+def get_clip_opts(clip):
+    """Kırpma ayarlarını yt-dlp seçeneklerine çevir"""
+    if not clip:
+        return {}
+    if 'chapter' in clip:
+        ranges = yt_dlp.utils.download_range_func([get_chapter_pattern(clip['chapter'])], [])
+    else:
+        end = clip['end'] if clip['end'] is not None else math.inf
+        ranges = yt_dlp.utils.download_range_func(None, [(clip['start'], end)])
+    opts = {'download_ranges': ranges}
+    if clip['precise']:
+        # Kesim noktalarında anahtar kare üretmek için yeniden kodlar: tam kesim, daha çok CPU
+        opts['force_keyframes_at_cuts'] = True
+    return opts
+
+# ============ Bandwidth Governor ============
+# GLOBAL_BANDWIDTH_LIMIT (bayt/sn, 0 = sınırsız) aktif indirmeler arasında paylaştırılır: her
+# session eşit pay alır, session içindeki işler önceliğe göre ağırlıklandırılır. İş başlayıp
+# bittikçe paylar yeniden hesaplanır. Sınır süreç başınadır (queue worker'ları ayrı ayrı uygular).
+GLOBAL_BANDWIDTH_LIMIT = int(os.environ.get('GLOBAL_BANDWIDTH_LIMIT', '0'))
+BANDWIDTH_PRIORITY_WEIGHTS = {0: 2.0, 1: 1.5, 2: 1.0}  # ses ve kısa videolar önce biter
+BANDWIDTH_BURST_SECONDS = 1.0  # kova kapasitesi: bu kadar saniyelik pay
+BANDWIDTH_MEASURE_INTERVAL = 1.0  # ulaşılan hız bu pencerelerle ölçülür
+
+class BandwidthGovernor:
+    """Global hız sınırını aktif işlere bölen ve her işi kendi token kovasıyla kısan yönetici.
+
+    Kısma, indirme thread'inde çağrılan progress hook içinde uyuyarak yapılır; bu yüzden hem
+    tek parça HTTP hem de paralel parçalı indirmelerde ve iş başladıktan sonra da geçerlidir.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.jobs = {}  # download_id -> {'session', 'priority', 'allocated', 'achieved', 'tokens', ...}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.limit > 0
+
+    @contextlib.contextmanager
+    def track(self, download_id, session_id, priority):
+        """İş süresince payı ayrılsın; bitince pay diğer işlere dağıtılır"""
+        if not self.enabled:
+            yield
+            return
+        with self.lock:
+            self.jobs[download_id] = {'session': session_id, 'priority': priority, 'allocated': 0,
+                                      'achieved': None, 'tokens': 0, 'refilled_at': time.monotonic(),
+                                      'window_started': time.monotonic(), 'window_bytes': 0, 'bytes': {}}
+            self._rebalance()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.jobs.pop(download_id, None)
+                self._rebalance()
+
+    def _rebalance(self):
+        # Önce session'lar eşit bölüşür, sonra her session'ın payı kendi işleri arasında
+        # öncelik ağırlığına göre bölünür
+        sessions = {}
+        for job in self.jobs.values():
+            weight = BANDWIDTH_PRIORITY_WEIGHTS.get(job['priority'], 1.0)
+            sessions[job['session']] = sessions.get(job['session'], 0) + weight
+        session_share = self.limit / len(sessions) if sessions else 0
+        for job in self.jobs.values():
+            weight = BANDWIDTH_PRIORITY_WEIGHTS.get(job['priority'], 1.0)
+            job['allocated'] = session_share * weight / sessions[job['session']]
+
+    def allocated(self, download_id):
+        with self.lock:
+            job = self.jobs.get(download_id)
+            return int(job['allocated']) if job else None
+
+    def hook(self, download_id):
+        """İşin token kovasını tüketen ve gerekirse bekleten progress hook'u"""
+        def progress_hook(d):
+            if d['status'] != 'downloading':
+                return
+            with self.lock:
+                job = self.jobs.get(download_id)
+                if job is None:
+                    return
+                # downloaded_bytes dosya başına birikimli (video ve ses ayrı dosyalar); devam edilen
+                # .part dosyasında diskteki baytları da içerir, bu yüzden taban ilk olaydan alınır
+                key = d.get('tmpfilename') or d.get('filename')
+                downloaded = d.get('downloaded_bytes') or 0
+                baseline = job['bytes'].setdefault(key, downloaded)
+                delta = max(downloaded - baseline, 0)
+                job['bytes'][key] = max(downloaded, baseline)
+                
+                # Ulaşılan hız: yt-dlp'nin anlık hızı bekleme sürelerini içermez, pencere ortalaması
+                now = time.monotonic()
+                job['window_bytes'] += delta
+                elapsed = now - job['window_started']
+                if elapsed >= BANDWIDTH_MEASURE_INTERVAL:
+                    speed = job['window_bytes'] / elapsed
+                    job['achieved'] = speed if job['achieved'] is None else 0.5 * job['achieved'] + 0.5 * speed
+                    job['window_started'], job['window_bytes'] = now, 0
+
+                rate = max(job['allocated'], 1)
+                job['tokens'] = min(job['tokens'] + (now - job['refilled_at']) * rate,
+                                    rate * BANDWIDTH_BURST_SECONDS) - delta
+                job['refilled_at'] = now
+                wait = -job['tokens'] / rate if job['tokens'] < 0 else 0
+            if wait:
+                time.sleep(wait)
+        
+        return progress_hook
+
+    def job_stats(self, download_id):
+        with self.lock:
+            job = self.jobs.get(download_id)
+            if job is None:
+                return None
+            return {'allocated': int(job['allocated']), 'achieved': int(job['achieved'] or 0)}
+
+    def stats(self):
+        with self.lock:
+            jobs = {download_id: {'allocated': int(job['allocated']), 'achieved': int(job['achieved'] or 0),
+                                  'session': job['session'], 'priority': job['priority']}
+                    for download_id, job in self.jobs.items()}
+        return {'limit': self.limit, 'allocated': sum(job['allocated'] for job in jobs.values()),
+                'achieved': sum(job['achieved'] for job in jobs.values()), 'jobs': jobs}
+
+bandwidth_governor = BandwidthGovernor(GLOBAL_BANDWIDTH_LIMIT)
+
+# ============ Remux Planner ============
+# Birleştirmede ses her zaman AAC'ye çevrilmez: seçilen formatların codec'leri MP4 ile
+# uyumluysa akışlar olduğu gibi kopyalanır, yalnızca uyumsuz akış yeniden kodlanır.
+MP4_VIDEO_CODECS = {'avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'h265', 'hevc', 'av01', 'vp09', 'vp9'}
+MP4_AUDIO_CODECS = {'mp4a', 'aac', 'mp3', 'ac-3', 'ec-3'}
+MP4_EXTS = {'mp4', 'm4v', 'm4a', 'mov', 'aac'}
+REMUX_TRANSCODE_ARGS = {
+    'video': ['-c:v', 'libx264', '-preset', 'veryfast'],
+    'audio': ['-c:a', 'aac'],
+}
+
+def is_mp4_compatible(fmt, kind):
+    """Formatın video/ses akışı MP4'e kopyalanabilir mi"""
+    codec = fmt.get('vcodec' if kind == 'video' else 'acodec')
+    if not codec:
+        # Generic extractor codec vermeyebilir; uzantıdan tahmin et
+        return fmt.get('ext') in MP4_EXTS
+    family = codec.split('.')[0].lower()
+    return family in (MP4_VIDEO_CODECS if kind == 'video' else MP4_AUDIO_CODECS)
+
+def plan_remux(requested_formats):
+    """Birleştirilecek formatlar için (plan adı, ffmpeg argümanları) döndür"""
+    transcoded = []
+    for kind in ('video', 'audio'):
+        codec_field = 'vcodec' if kind == 'video' else 'acodec'
+        streams = [fmt for fmt in requested_formats if fmt.get(codec_field) != 'none']
+        if not all(is_mp4_compatible(fmt, kind) for fmt in streams):
+            transcoded.append(kind)
+    
+    if not transcoded:
+        return 'copy', []
+    args = [arg for kind in transcoded for arg in REMUX_TRANSCODE_ARGS[kind]]
+    return 'transcode-' + '-'.join(transcoded), args
+
+class RemuxPlanner(PostProcessor):
+    """İndirme başlamadan seçilen formatlara göre birleştirme argümanlarını ayarlar"""
+
+    def __init__(self, downloader=None, download_id=None):
+        super().__init__(downloader)
+        self.download_id = download_id
+        self.plan = None
+
+    def run(self, info):
+        requested = info.get('requested_formats')
+        if not requested or len(requested) < 2:
+            self.plan = 'none'
+            return [], info
+        
+        self.plan, args = plan_remux(requested)
+        codecs = ', '.join(f"{f.get('format_id')}:{f.get('vcodec')}/{f.get('acodec')}" for f in requested)
+        log.info("Remux planned", extra={'download_id': self.download_id, 'plan': self.plan, 'codecs': codecs})
+        # Yalnızca birleştiriciye uygulanır; fixup işlemleri stream copy kalır
+        postprocessor_args = dict(self.get_param('postprocessor_args') or {})
+        postprocessor_args['merger+ffmpeg'] = args
+        self._downloader.params['postprocessor_args'] = postprocessor_args
+        return [], info
+
+def make_progress_hook(download_id, publish):
+    """İlerlemeyi publish(download_id, **alanlar) ile bildiren yt-dlp progress hook'u oluştur"""
+    last_update = [0]
+    finished_bytes = [0]
+    
+    def progress_hook(d):
+        if d['status'] == 'downloading':
+            # yt-dlp bu hook'u çok sık çağırır; yazmaları PROGRESS_UPDATE_INTERVAL ile sınırla
+            now = time.time()
+            if now - last_update[0] < PROGRESS_UPDATE_INTERVAL:
+                return
+            last_update[0] = now
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            downloaded = d.get('downloaded_bytes') or 0
+            fields = {'speed': d.get('speed'), 'eta': d.get('eta'), 'downloaded_bytes': downloaded}
+            if total > 0:
+                fields['progress'] = int((downloaded / total) * 100)
+                fields['total_bytes'] = total
+            publish(download_id, **fields)
+            log.info("Download progress", extra=dict(fields, download_id=download_id,
+                                                     sample_rate=LOG_SAMPLE_RATE))
+        elif d['status'] == 'finished':
+            # Video ve ses ayrı dosyalarsa her biri için çağrılır; metrikler için toplamı tut
+            finished_bytes[0] += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            publish(download_id, progress=100, eta=0,
+                    download_finished_at=time.time(), downloaded_total=finished_bytes[0])
+    
+    return progress_hook
+
+EXPIRED_URL_STATUSES = (403, 410)
+
+def is_expired_url_error(error):
+    """Önceden çıkarılmış imzalı format URL'si sunucu tarafından reddedildi mi"""
+    cause = error.exc_info[1] if error.exc_info else None
+    if isinstance(cause, yt_dlp.networking.exceptions.HTTPError):
+        return cause.status in EXPIRED_URL_STATUSES
+    return bool(re.search(r'HTTP Error (403|410)\b|expired', str(error), re.IGNORECASE))
+
+def run_ydl_download(url, cookie_file, ydl_opts, info=None, download_id=None, adaptive=False):
+    """yt-dlp indirmesini havuzdan alınan örnekle çalıştır; varsa önceden çıkarılmış info kullanılır.
+
+    Seçilen birleştirme planını döndürür.
+    """
+    with ydl_pool.checkout(cookie_file, ydl_opts) as ydl:
+        planner = RemuxPlanner(ydl, download_id)
+        ydl.add_post_processor(planner, when='before_dl')
+        if adaptive:
+            ydl.add_progress_hook(AdaptiveTransferTuner(ydl.params, download_id).hook)
+        if info:
+            log.debug(f"Reusing extracted info for {download_id}")
+            try:
+                ydl.process_ie_result(info, download=True)
+            except yt_dlp.utils.DownloadError as e:
+                # Yalnızca imzalı URL'ler reddedildiyse baştan çıkarıp tekrar dene; diğer hatalarda
+                # (ör. birleştirme) tekrar indirmek aynı hatayı iki kez yaşatır
+                if not is_expired_url_error(e):
+                    raise
+                log.warning(f"Download with cached info failed, re-extracting: {e}")
+                ydl.download([url])
+        else:
+            ydl.download([url])
+        return planner.plan
+
+def run_download_in_worker(url, download_id, cookie_file, ydl_opts, info=None, adaptive=False):
+    """İşçi süreçte indir; ilerleme kuyruk üzerinden web sürecine gönderilir"""
+    trace_id_var.set(download_id)
+    ydl_opts['progress_hooks'] = [make_progress_hook(download_id, publish_worker_progress)]
+    return run_ydl_download(url, cookie_file, ydl_opts, info, download_id, adaptive)
+
+def record_job_metrics(status, started_at):
+    """Biten işin indirme, birleştirme ve hız metriklerini kaydet"""
+    METRICS['jobs'].inc(result='completed')
+    finished_at = (status or {}).get('download_finished_at')
+    if not finished_at:
+        return
+    download_seconds = max(finished_at - started_at, 0.001)
+    METRICS['download'].observe(download_seconds)
+    METRICS['postprocess'].observe(max(time.time() - finished_at, 0))
+    METRICS['throughput'].observe(status.get('downloaded_total', 0) / download_seconds)
+
+def download_video(url, format_id, download_id, cookie_file=None, cache_key=None, transfer=None,
+                   reserve_bytes=DEFAULT_JOB_RESERVATION, clip=None):
+    """Video indir"""
+    trace_id_var.set(download_id)
+    log.info("Download started", extra={'download_id': download_id, 'format_id': format_id,
+                                        'has_cookies': bool(cookie_file)})
+    update_download_status(download_id, status='downloading', progress=0, filename=None)
+    job_journal.transition(download_id, 'downloading')
+    started_at = time.time()
+
+    file_prefix = file_cache.prefix(cache_key) if cache_key else download_id
+    output_template = os.path.join(DOWNLOAD_FOLDER, f'{file_prefix}_%(title)s.%(ext)s')
+    
+    # Basitleştirilmiş format seçenekleri
+    max_height = FORMAT_MAX_HEIGHTS.get(format_id)
+    if format_id == 'bestaudio':
+        format_string = 'bestaudio/best'
+    elif max_height:
+        format_string = f'bv*[height<={max_height}]+ba/b[height<={max_height}]/b'
+    else:  # best
+        format_string = 'bv*+ba/b'
+    
+    log.debug(f"Using format string: {format_string}")
+    
+    # Temel ayarlar (cookie, header'lar) havuzdaki örnekten gelir; bunlar iş bazlıdır
+    ydl_opts = {
+        'format': format_string,
+        'outtmpl': output_template,
+        'merge_output_format': 'mp4',
+        # Yeniden başlatılan işler aynı önekli .part dosyalarından devam eder
+        'continuedl': True,
+        # FFmpeg ayarları; birleştirme argümanlarını RemuxPlanner belirler
+        'prefer_ffmpeg': True,
+    }
+    ydl_opts.update(get_transfer_opts(transfer))
+    ydl_opts.update(get_clip_opts(clip))
+    adaptive = bool(transfer and transfer.get('adaptive'))
+    
+    locks = contextlib.ExitStack()
+    try:
+        # Başka süreç aynı çıktıyı indiriyorsa beklemeden ertele; yeniden denemede yt-dlp bitmiş
+        # dosyayı bulur ve indirmeyi atlar
+        locks.enter_context(output_lock(file_prefix))
+        info = get_reusable_info(url, cookie_file)
+        if clip and 'chapter' in clip and info and not get_clip_span(info, clip):
+            raise ValueError(f"Bölüm bulunamadı: {clip['chapter']}")
+        admit_download(download_id, estimate_download_size(info, format_id, clip) or reserve_bytes)
+        if download_pool.enabled:
+            # İşçi süreçteki indirme canlı yeniden dağıtımı göremez; başlangıç payı sabit sınır olur
+            if bandwidth_governor.enabled:
+                ydl_opts['ratelimit'] = bandwidth_governor.allocated(download_id) or None
+            remux = download_pool.run(run_download_in_worker, url, download_id, cookie_file,
+                                      ydl_opts, info, adaptive)
+        else:
+            ydl_opts['progress_hooks'] = [make_progress_hook(download_id, update_download_status)]
+            if bandwidth_governor.enabled:
+                ydl_opts['progress_hooks'].append(bandwidth_governor.hook(download_id))
+            remux = run_ydl_download(url, cookie_file, ydl_opts, info, download_id, adaptive)
+        if remux:
+            METRICS['remux'].inc(plan=remux)
+        
+        for filename in os.listdir(DOWNLOAD_FOLDER):
+            if filename.startswith(file_prefix + '_') and not filename.endswith(('.part', '.ytdl')):
+                status = update_download_status(download_id, status='completed', filename=filename,
+                                                remux=remux)
+                job_journal.transition(download_id, 'completed', file=filename)
+                record_job_metrics(status, started_at)
+                log.info("Download completed", extra={'download_id': download_id, 'file': filename,
+                                                      'duration': round(time.time() - started_at, 3)})
+                if cache_key:
+                    for follower_id in file_cache.complete(cache_key, filename):
+                        update_download_status(follower_id, status='completed', progress=100, filename=filename)
+                return
+        
+        error = 'Dosya bulunamadı'
+    except JobDeferredError as e:
+        # Çağıran (zamanlayıcı ya da kuyruk worker'ı) işi daha sonra yeniden dener
+        update_download_status(download_id, status='queued', waiting_for=e.waiting_for)
+        job_journal.transition(download_id, 'queued', waiting_for=e.waiting_for)
+        raise
+    except Exception as e:
+        error = str(e)
+    finally:
+        storage.release(download_id)
+        locks.close()
+    
+    update_download_status(download_id, status='error', error=error)
+    job_journal.transition(download_id, 'error', error=error)
+    METRICS['jobs'].inc(result='error')
+    log.error("Download failed", extra={'download_id': download_id, 'error': error})
+    if cache_key:
+        for follower_id in file_cache.fail(cache_key):
+            update_download_status(follower_id, status='error', error=error)
+
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get('PROGRESS_UPDATE_INTERVAL', '0.5'))  # saniye
+
+# ============ Download Scheduler ============
+# Sınırlı worker havuzu: her istek için yeni thread açmak yerine işler kuyruğa alınır
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', '2'))
+SHORT_VIDEO_DURATION = 600  # 10 dakikadan kısa videolar öncelikli
+DEFAULT_JOB_DURATION = 30  # ETA tahmini için başlangıç değeri (saniye)
+
+def get_job_priority(format_id, duration=None):
+    """Küçük değer = yüksek öncelik (önce ses, sonra kısa videolar)"""
+    if format_id == 'bestaudio':
+        return 0
+    if duration and duration <= SHORT_VIDEO_DURATION:
+        return 1
+    return 2
+
+class DownloadScheduler:
+    """Öncelik kuyruklu, session bazlı adil, sınırlı sayıda worker ile çalışan zamanlayıcı"""
+
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self.queue = []  # heap: (priority, session_round, seq, download_id)
+        self.jobs = {}  # download_id -> (args, session_id)
+        self.session_pending = {}  # session_id -> kuyrukta/çalışan iş sayısı
+        self.active = set()
+        self.avg_job_duration = DEFAULT_JOB_DURATION
+        self.seq = 0
+        self.lock = threading.Condition()
+        self.workers = []
+
+    def _ensure_workers(self):
+        # Worker'lar ilk işte başlatılır (gunicorn --preload fork'undan sonra)
+        self.workers = [t for t in self.workers if t.is_alive()]
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, download_id, args, session_id=None, priority=2):
+        """İşi kuyruğa ekle"""
+        with self.lock:
+            self._ensure_workers()
+            session_round = self.session_pending.get(session_id, 0)
+            self.session_pending[session_id] = session_round + 1
+            self.seq += 1
+            heapq.heappush(self.queue, (priority, session_round, self.seq, download_id))
+            self.jobs[download_id] = (args, session_id)
+            self.lock.notify()
+
+    def position(self, download_id):
+        """Kuyruktaki sıra (1'den başlar), kuyrukta değilse None"""
+        with self.lock:
+            for index, entry in enumerate(sorted(self.queue)):
+                if entry[3] == download_id:
+                    return index + 1
+        return None
+
+    def estimate_wait(self, position):
+        """Kuyruk sırasına göre tahmini bekleme süresi (saniye)"""
+        return int(position / self.max_workers * self.avg_job_duration)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'active': len(self.active),
+                'queued': len(self.queue),
+                'avg_job_duration': round(self.avg_job_duration, 1)
+            }
+
+    def _worker_loop(self):
+        while True:
+            with self.lock:
+                while not self.queue:
+                    self.lock.wait()
+                priority, _, _, download_id = heapq.heappop(self.queue)
+                args, session_id = self.jobs.pop(download_id)
+                self.active.add(download_id)
+
+            started_at = time.time()
+            deferred = False
+            try:
+                with bandwidth_governor.track(download_id, session_id, priority):
+                    download_video(*args)
+            except JobDeferredError:
+                # Yer ya da çıktı açılana kadar worker'ı tutma; iş aynı öncelikle kuyruğa geri döner
+                deferred = True
+                janitor.schedule(JOB_RETRY_INTERVAL, self.submit, download_id, args, session_id, priority)
+            except Exception:
+                log.exception(f"Scheduler job {download_id} failed")
+            finally:
+                elapsed = time.time() - started_at
+                with self.lock:
+                    self.active.discard(download_id)
+                    # Üstel hareketli ortalama ile ETA tahminini güncelle
+                    if not deferred:
+                        self.avg_job_duration = 0.8 * self.avg_job_duration + 0.2 * elapsed
+                    remaining = self.session_pending.get(session_id, 1) - 1
+                    if remaining > 0:
+                        self.session_pending[session_id] = remaining
+                    else:
+                        self.session_pending.pop(session_id, None)
+
+download_scheduler = DownloadScheduler(MAX_CONCURRENT_DOWNLOADS)
+
+def enqueue_download(url, format_id, cookie_file=None, session_id=None, duration=None, transfer=None,
+                     download_id=None, clip=None):
+    """İndirme kaydını oluştur ve işi zamanlayıcıya (ya da worker kuyruğuna) ver, download_id döndür.
+
+    download_id verilirse (yarıda kalmış iş) aynı kimlik ve dosya önekiyle yeniden kuyruğa alınır.
+    """
+    resumed = download_id is not None
+    download_id = download_id or str(uuid.uuid4())[:8]
+    download_status[download_id] = {
+        'status': 'queued',
+        'progress': 0,
+        'filename': None,
+        'created_at': time.time(),
+        **({'resumed': True} if resumed else {})
+    }
+    janitor.expire(download_status, download_id, JOB_RECORD_TTL, is_download_active)
+    
+    spec = {'url': url, 'format_id': format_id, 'cookie_file': cookie_file,
+            'session_id': session_id, 'duration': duration, 'transfer': transfer, 'clip': clip}
+    if job_queue:
+        # İndirmeyi worker süreçleri yapar; web süreci yalnızca kuyruğa yazar
+        job_queue.push(download_id, spec)
+        return download_id
+    
+    job = prepare_download(download_id, spec)
+    if job:
+        args, priority = job
+        download_scheduler.submit(download_id, args, session_id=session_id, priority=priority)
+    return download_id
+
+def prepare_download(download_id, spec):
+    """Önbellek ve kota kontrollerini yap; indirilecekse (download_video argümanları, öncelik) döndür"""
+    url, format_id, cookie_file = spec['url'], spec['format_id'], spec['cookie_file']
+    clip = spec.get('clip')
+    
+    # Aynı video, kalite, aralık (ve cookie) daha önce indirildiyse ya da şu an iniyorsa tekrar indirme
+    cache_key = get_file_cache_key(url, format_id, clip, cookie_file)
+    state, value = file_cache.begin(cache_key, download_id)
+    if state == 'hit':
+        update_download_status(download_id, status='completed', progress=100, filename=value)
+        return None
+    if state == 'attached':
+        update_download_status(download_id, attached_to=value)
+        return None
+    
+    duration = spec['duration']
+    cached = metadata_cache.peek((get_canonical_video_key(url), cookie_file))
+    if cached:
+        duration = cached['info'].get('duration')
+        span = get_clip_span(cached['info'], clip)
+        if span and span[1] != math.inf:
+            # Kısa bir klip kısa video gibi önceliklendirilir
+            duration = span[1] - span[0]
+    reserve_bytes = storage.reservation_for(cached and cached['info'], format_id, clip)
+    error = storage.admission_error(reserve_bytes)
+    if error:
+        for follower in file_cache.fail(cache_key):
+            update_download_status(follower, status='error', error=error)
+        update_download_status(download_id, status='error', error=error)
+        return None
+    priority = get_job_priority(format_id, duration)
+    job_journal.record(download_id, file_cache.prefix(cache_key), spec, priority)
+    return (url, format_id, download_id, cookie_file, cache_key, spec['transfer'], reserve_bytes, clip), priority
+
+# ============ Job Journal ============
+# İşler yalnızca thread ve download_status kaydı olarak yaşarsa gunicorn timeout'u, deploy ya da
+# OOM çalışan her indirmeyi (ve GB'larca .part verisini) kaybettirir. Her işin durum geçişleri
+# SQLite'a yazılır; yarıda kalan işler yeniden kuyruğa alınır ve .part dosyalarından devam eder.
+JOB_JOURNAL_PATH = os.environ.get('JOB_JOURNAL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db'))
+JOB_HEARTBEAT_INTERVAL = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', '15'))  # saniye
+JOB_HEARTBEAT_TIMEOUT = int(os.environ.get('JOB_HEARTBEAT_TIMEOUT', '60'))  # sahibi ölmüş sayılır
+JOB_MAX_RESUMES = int(os.environ.get('JOB_MAX_RESUMES', '3'))  # çökme döngüsüne giren işler için
+JOB_JOURNAL_RETENTION = 86400  # biten işlerin geçmişi bu kadar saklanır
+JOB_ACTIVE_STATES = ('queued', 'downloading', 'interrupted')
+
+class JobJournal:
+    """İşlerin tanımını, sahibini ve durum geçişlerini kalıcı olarak tutan SQLite günlüğü.
+
+    Her süreç sahiplendiği işler için periyodik heartbeat yazar. Sahibi düzgün kapanırken
+    'interrupted' olarak bırakılan ya da heartbeat'i JOB_HEARTBEAT_TIMEOUT'u aşan işler başka
+    (veya yeniden başlayan) bir süreç tarafından devralınır.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.owner_pid = None
+        self.owner_id = None
+        self.counters = {'recorded': 0, 'resumed': 0, 'abandoned': 0}
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'download_id TEXT PRIMARY KEY, spec TEXT NOT NULL, file_prefix TEXT NOT NULL, '
+                'state TEXT NOT NULL, owner TEXT, attempts INTEGER NOT NULL DEFAULT 0, '
+                'heartbeat_at REAL NOT NULL, updated_at REAL NOT NULL, priority INTEGER NOT NULL DEFAULT 2)'
+            )
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+            if 'priority' not in columns:
+                conn.execute('ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 2')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_events ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, download_id TEXT NOT NULL, '
+                'state TEXT NOT NULL, detail TEXT, at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS job_events_download_id ON job_events (download_id)')
+
+    def _connect(self):
+        # SQLiteStateStore ile aynı: thread başına bağlantı, fork sonrası yeniden açılır
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    @property
+    def owner(self):
+        # PID'ler konteyner yeniden başlayınca tekrar kullanılabilir; süreç başına rastgele kimlik
+        if self.owner_pid != os.getpid():
+            self.owner_pid = os.getpid()
+            self.owner_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        return self.owner_id
+
+    def _event(self, conn, download_id, state, detail=None):
+        conn.execute('INSERT INTO job_events (download_id, state, detail, at) VALUES (?, ?, ?, ?)',
+                     (download_id, state, json.dumps(detail) if detail else None, time.time()))
+
+    def record(self, download_id, file_prefix, spec, priority=2, claim=True):
+        """Kuyruğa alınan işi kaydet (devralınan iş için deneme sayısı korunur).
+
+        claim=False ise iş sahipsiz bırakılır ve bir worker süreci claim_next ile alır.
+        """
+        now = time.time()
+        conn = self._connect()
+        with SQLiteStateStore._transaction(conn):
+            conn.execute(
+                'INSERT INTO jobs (download_id, spec, file_prefix, state, owner, heartbeat_at, updated_at, priority) '
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?) ON CONFLICT (download_id) DO UPDATE SET "
+                "state = 'queued', owner = excluded.owner, heartbeat_at = excluded.heartbeat_at, "
+                'updated_at = excluded.updated_at, priority = excluded.priority',
+                (download_id, json.dumps(spec), file_prefix, self.owner if claim else None, now, now, priority)
+            )
+            self._event(conn, download_id, 'queued')
+        self.counters['recorded'] += 1
+
+    def claim_next(self):
+        """En öncelikli sahipsiz işi bu sürece al; (download_id, spec) veya None döndür"""
+        conn = self._connect()
+        with SQLiteStateStore._transaction(conn):
+            row = conn.execute(
+                "SELECT download_id, spec FROM jobs WHERE state = 'queued' AND owner IS NULL "
+                'ORDER BY priority, updated_at LIMIT 1'
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE jobs SET owner = ?, heartbeat_at = ? WHERE download_id = ?',
+                         (self.owner, time.time(), row[0]))
+            self._event(conn, row[0], 'claimed', {'owner': self.owner})
+        return row[0], json.loads(row[1])
+
+    def pending_count(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE state = 'queued' AND owner IS NULL"
+        ).fetchone()[0]
+
+    def transition(self, download_id, state, **detail):
+        """İşin durumunu güncelle ve geçişi olay olarak ekle"""
+        now = time.time()
+        conn = self._connect()
+        with SQLiteStateStore._transaction(conn):
+            updated = conn.execute(
+                'UPDATE jobs SET state = ?, heartbeat_at = ?, updated_at = ? WHERE download_id = ?',
+                (state, now, now, download_id)
+            ).rowcount
+            if updated:
+                self._event(conn, download_id, state, detail)
+
+    def heartbeat(self):
+        self._connect().execute(
+            f'UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND state IN {JOB_ACTIVE_STATES}',
+            (time.time(), self.owner)
+        )
+
+    def claim_orphans(self):
+        """Sahibi kapanmış ya da ölmüş işleri bu sürece al; [(download_id, spec, attempts)] döndür"""
+        now = time.time()
+        conn = self._connect()
+        with SQLiteStateStore._transaction(conn):
+            rows = conn.execute(
+                f'SELECT download_id, spec, attempts FROM jobs WHERE state IN {JOB_ACTIVE_STATES} '
+                "AND owner IS NOT NULL AND owner != ? AND (state = 'interrupted' OR heartbeat_at < ?)",
+                (self.owner, now - JOB_HEARTBEAT_TIMEOUT)
+            ).fetchall()
+            for download_id, _, attempts in rows:
+                conn.execute('UPDATE jobs SET owner = ?, attempts = ?, heartbeat_at = ? WHERE download_id = ?',
+                             (self.owner, attempts + 1, now, download_id))
+                self._event(conn, download_id, 'claimed', {'attempt': attempts + 1})
+        return [(download_id, json.loads(spec), attempts + 1) for download_id, spec, attempts in rows]
+
+    def release_owned(self):
+        """Düzgün kapanışta bu sürecin bitmemiş işlerini hemen devralınabilir olarak işaretle"""
+        conn = self._connect()
+        with SQLiteStateStore._transaction(conn):
+            rows = conn.execute(
+                "SELECT download_id FROM jobs WHERE owner = ? AND state IN ('queued', 'downloading')",
+                (self.owner,)
+            ).fetchall()
+            for (download_id,) in rows:
+                conn.execute("UPDATE jobs SET state = 'interrupted', updated_at = ? WHERE download_id = ?",
+                             (time.time(), download_id))
+                self._event(conn, download_id, 'interrupted')
+        return len(rows)
+
+    def resumable_prefixes(self):
+        """Bitmemiş işlerin dosya önekleri (.part dosyaları silinmemeli)"""
+        rows = self._connect().execute(
+            f'SELECT file_prefix FROM jobs WHERE state IN {JOB_ACTIVE_STATES}'
+        ).fetchall()
+        return {prefix for (prefix,) in rows}
+
+    def prune(self):
+        """Saklama süresi dolan biten işleri ve olaylarını sil"""
+        conn = self._connect()
+        cutoff = time.time() - JOB_JOURNAL_RETENTION
+        with SQLiteStateStore._transaction(conn):
+            conn.execute(
+                'DELETE FROM job_events WHERE download_id IN (SELECT download_id FROM jobs '
+                f'WHERE state NOT IN {JOB_ACTIVE_STATES} AND updated_at < ?)', (cutoff,)
+            )
+            conn.execute(f'DELETE FROM jobs WHERE state NOT IN {JOB_ACTIVE_STATES} AND updated_at < ?', (cutoff,))
+
+    def events(self, download_id):
+        rows = self._connect().execute(
+            'SELECT state, detail, at FROM job_events WHERE download_id = ? ORDER BY id', (download_id,)
+        ).fetchall()
+        return [{'state': state, 'at': at, **(json.loads(detail) if detail else {})} for state, detail, at in rows]
+
+    def stats(self):
+        rows = self._connect().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict(self.counters, states=dict(rows))
+
+job_journal = JobJournal(JOB_JOURNAL_PATH)
+
+def resume_interrupted_jobs():
+    """Devralınan işleri aynı download_id ile yeniden kuyruğa al"""
+    for download_id, spec, attempts in job_journal.claim_orphans():
+        if attempts > JOB_MAX_RESUMES:
+            error = 'İndirme tekrar tekrar yarıda kaldı'
+            job_journal.transition(download_id, 'error', error=error)
+            download_status[download_id] = {'status': 'error', 'error': error, 'progress': 0,
+                                            'filename': None, 'created_at': time.time()}
+            janitor.expire(download_status, download_id, JOB_RECORD_TTL, is_download_active)
+            job_journal.counters['abandoned'] += 1
+            continue
+        log.info("Resuming interrupted download", extra={'download_id': download_id, 'attempt': attempts})
+        job_journal.counters['resumed'] += 1
+        if job_queue:
+            job_queue.resume(download_id, spec)
+            continue
+        enqueue_download(spec['url'], spec['format_id'], spec['cookie_file'], session_id=spec['session_id'],
+                         duration=spec['duration'], transfer=spec['transfer'], download_id=download_id,
+                         clip=spec.get('clip'))
+        status = download_status.get(download_id) or {}
+        if status.get('status') != 'queued' or status.get('attached_to'):
+            settle_unscheduled_job(download_id)
+
+def settle_unscheduled_job(download_id):
+    """Önbellekten ya da başka bir indirmeden karşılanan işi kapat; günlükte bekleyen iş kalmasın"""
+    status = download_status.get(download_id) or {}
+    job_journal.transition(download_id, 'error' if status.get('status') == 'error' else 'completed')
+
+def maintain_job_journal():
+    """Heartbeat yaz, sahipsiz işleri devral, eski kayıtları temizle; periyodik çalışır"""
+    try:
+        job_journal.heartbeat()
+        if job_queue:
+            try:
+                job_queue.maintain()
+            except Exception:
+                # Kuyruk backend'i (ör. Redis bağlantısı) geçici olarak erişilemiyor; yerel bakım sürsün
+                log.exception("Job queue maintenance failed")
+        resume_interrupted_jobs()
+        job_journal.prune()
+    except Exception:
+        log.exception("Job journal maintenance failed")
+    finally:
+        # Döngü durursa heartbeat kesilir ve diğer süreçler bu sürecin işlerini yeniden indirir
+        janitor.schedule(JOB_HEARTBEAT_INTERVAL, maintain_job_journal)
+
+journal_started_pid = None
+
+def start_job_journal():
+    """Bu süreçte günlük bakımını başlat.
+
+    Gunicorn'da gunicorn.conf.py içindeki post_worker_init, ASGI'de lifespan startup,
+    kuyruk worker'ında run_worker çağırır; before_request yalnızca diğer sunucular için yedek.
+    """
+    global journal_started_pid
+    if journal_started_pid == os.getpid():
+        return
+    journal_started_pid = os.getpid()
+    atexit.register(release_job_journal)
+    maintain_job_journal()
+
+def release_job_journal():
+    released = job_journal.release_owned()
+    if job_queue:
+        released += job_queue.release()
+    if released:
+        log.info("Released unfinished downloads for resumption", extra={'count': released})
+
+# İşçi süreçler (spawn ile app'i yeniden import eder) klasöre dokunmaz. Klasörü paylaşan süreçlerden
+# yalnızca biri (gunicorn --preload ile master) eski dosyaları toplar ve sahiplenir; aynı dosya iki
+# sürecin bütçesinde sayılmaz ve biri diğerinin gönderdiği dosyayı silmez.
+if multiprocessing.parent_process() is None:
+    if hold_process_lock('storage-owner'):
+        storage.reclaim({data.get('filename') for _, data in download_status.items()},
+                        job_journal.resumable_prefixes())
+    else:
+        log.info("Storage reclaim skipped, another process owns the download folder")
+
+# ============ Job Queue ============
+# DOWNLOAD_QUEUE boşsa indirmeler web sürecinin zamanlayıcısında çalışır. 'sqlite' (aynı makinede
+# birden fazla süreç; iş günlüğü kuyruk olarak kullanılır) veya 'redis' (makineler arası) seçilirse
+# web süreçleri işi yalnızca kuyruğa yazar ve durumu okur; indirmeleri `python -m app worker` yapar.
+# Web ve worker'ların durumu paylaşması için STATE_BACKEND=sqlite/redis ve ortak DOWNLOAD_FOLDER gerekir.
+# Aynı klasördeki worker'lar aynı çıktıyı output_lock (flock, yerel dosya sistemi) ile paylaşmaz; kota ve
+# önbellek bütçesi ise süreç başınadır, bu yüzden worker sayısı STORAGE_PROCESS_COUNT'u aşamaz.
+DOWNLOAD_QUEUE = os.environ.get('DOWNLOAD_QUEUE', '')
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', str(MAX_CONCURRENT_DOWNLOADS)))
+WORKER_DRAIN_TIMEOUT = int(os.environ.get('WORKER_DRAIN_TIMEOUT', '30'))  # SIGTERM sonrası bekleme
+QUEUE_POLL_INTERVAL = float(os.environ.get('QUEUE_POLL_INTERVAL', '1'))  # saniye
+
+def get_spec_priority(spec):
+    return get_job_priority(spec['format_id'], spec['duration'])
+
+def get_spec_prefix(spec):
+    return file_cache.prefix(get_file_cache_key(spec['url'], spec['format_id'], spec.get('clip'),
+                                            spec['cookie_file']))
+
+class SQLiteJobQueue:
+    """İş günlüğündeki sahipsiz 'queued' kayıtlarını kuyruk olarak kullanır (aynı makine)"""
+
+    def __init__(self, journal):
+        self.journal = journal
+
+    def push(self, download_id, spec):
+        self.journal.record(download_id, get_spec_prefix(spec), spec, get_spec_priority(spec), claim=False)
+
+    def claim(self):
+        return self.journal.claim_next()
+
+    def ack(self, download_id):
+        # Bitiş durumu download_video tarafından günlüğe zaten yazıldı
+        pass
+
+    def resume(self, download_id, spec):
+        """Devralınan yarım işi herhangi bir worker alabilsin diye kuyruğa geri koy"""
+        self.push(download_id, spec)
+
+    def maintain(self):
+        # Heartbeat ve sahipsiz iş devri iş günlüğünde yapılır
+        pass
+
+    def release(self):
+        return 0
+
+    def stats(self):
+        return {'backend': 'sqlite', 'pending': self.journal.pending_count()}
+
+# Bekleyen en öncelikli işi atomik olarak alıp çalışanlar hash'ine yazar
+REDIS_CLAIM_SCRIPT = """
+local item = redis.call('ZPOPMIN', KEYS[1])
+if #item == 0 then return false end
+redis.call('HSET', KEYS[2], item[1], ARGV[1])
+return item[1]
+"""
+
+class RedisJobQueue:
+    """Makineler arası iş kuyruğu: bekleyenler öncelik sıralı sorted set'te, çalışanlar heartbeat hash'inde.
+
+    Heartbeat'i JOB_HEARTBEAT_TIMEOUT'u aşan işler (worker'ı ölmüş) herhangi bir worker tarafından
+    yeniden kuyruğa alınır; yerel iş günlüğü yalnızca bu makinedeki .part dosyalarını korur.
+    """
+
+    def __init__(self, url):
+        import redis  # yalnızca bu backend seçildiğinde gerekli
+        self.client = redis.Redis.from_url(url)
+        self.backend_error = redis.exceptions.RedisError
+        self.claim_script = self.client.register_script(REDIS_CLAIM_SCRIPT)
+        self.pending_key = 'vd:queue:pending'
+        self.jobs_key = 'vd:queue:jobs'
+        self.running_key = 'vd:queue:running'
+        self.active = set()  # bu sürecin çalıştırdığı işler
+        self.lock = threading.Lock()
+        self.counters = {'pushed': 0, 'claimed': 0, 'requeued': 0}
+
+    def _score(self, spec):
+        # Önce öncelik, aynı öncelikte ekleme sırası
+        return get_spec_priority(spec) * 1e10 + time.time()
+
+    def push(self, download_id, spec):
+        with self.client.pipeline() as pipe:
+            pipe.hset(self.jobs_key, download_id, json.dumps(spec))
+            pipe.zadd(self.pending_key, {download_id: self._score(spec)})
+            pipe.execute()
+        self.counters['pushed'] += 1
+
+    def claim(self):
+        download_id = self.claim_script(keys=[self.pending_key, self.running_key], args=[time.time()])
+        if not download_id:
+            return None
+        download_id = download_id.decode()
+        spec = self.client.hget(self.jobs_key, download_id)
+        if spec is None:
+            # İş arada tamamlandı
+            self.client.hdel(self.running_key, download_id)
+            return None
+        with self.lock:
+            self.active.add(download_id)
+        self.counters['claimed'] += 1
+        return download_id, json.loads(spec)
+
+    def ack(self, download_id):
+        with self.client.pipeline() as pipe:
+            pipe.hdel(self.running_key, download_id)
+            pipe.hdel(self.jobs_key, download_id)
+            pipe.execute()
+        with self.lock:
+            self.active.discard(download_id)
+
+    def _requeue(self, download_id):
+        # HDEL'i başaran süreç yeniden kuyruğa alır; aynı iş iki kez eklenmez
+        if not self.client.hdel(self.running_key, download_id):
+            return False
+        spec = self.client.hget(self.jobs_key, download_id)
+        if spec is None:
+            return False
+        self.client.zadd(self.pending_key, {download_id: self._score(json.loads(spec))})
+        self.counters['requeued'] += 1
+        return True
+
+    def resume(self, download_id, spec):
+        # Yerel günlükteki yarım iş Redis'teki heartbeat zaman aşımıyla zaten yeniden kuyruğa alınır
+        job_journal.transition(download_id, 'requeued')
+
+    def maintain(self):
+        """Çalışan işlerin heartbeat'ini yaz ve worker'ı ölmüş işleri yeniden kuyruğa al"""
+        now = time.time()
+        with self.lock:
+            active = list(self.active)
+        if active:
+            self.client.hset(self.running_key, mapping={download_id: now for download_id in active})
+        for download_id, heartbeat_at in self.client.hgetall(self.running_key).items():
+            if float(heartbeat_at) < now - JOB_HEARTBEAT_TIMEOUT:
+                self._requeue(download_id.decode())
+
+    def release(self):
+        """Düzgün kapanışta çalışan işleri beklemeden başka worker'lara bırak"""
+        with self.lock:
+            active, self.active = list(self.active), set()
+        return sum(self._requeue(download_id) for download_id in active)
+
+    def stats(self):
+        try:
+            return dict(self.counters, backend='redis', pending=self.client.zcard(self.pending_key),
+                        running=self.client.hlen(self.running_key))
+        except self.backend_error as e:
+            # /health Redis kesintisinde de yanıt vermeli
+            return dict(self.counters, backend='redis', error=str(e))
+
+def create_job_queue():
+    """DOWNLOAD_QUEUE için kuyruk oluştur; boşsa None (indirmeler süreç içinde çalışır)"""
+    if DOWNLOAD_QUEUE == 'sqlite':
+        return SQLiteJobQueue(job_journal)
+    if DOWNLOAD_QUEUE == 'redis':
+        return RedisJobQueue(REDIS_URL)
+    return None
+
+job_queue = create_job_queue()
+if job_queue and STATE_BACKEND == 'memory':
+    log.warning("DOWNLOAD_QUEUE requires a shared STATE_BACKEND (sqlite or redis) for status updates")
+
+def run_queued_job(download_id, spec):
+    """Kuyruktan alınan işi bu süreçte çalıştır"""
+    job = prepare_download(download_id, spec)
+    if not job:
+        settle_unscheduled_job(download_id)
+        return
+    args, priority = job
+    while True:
+        try:
+            with bandwidth_governor.track(download_id, spec['session_id'], priority):
+                download_video(*args)
+            return
+        except JobDeferredError:
+            # Worker süreci yalnızca indirme yapar; yer ya da çıktı açılmasını burada bekler
+            time.sleep(JOB_RETRY_INTERVAL)
+
+def queue_worker_loop(stopping):
+    while not stopping.is_set():
+        try:
+            job = job_queue.claim()
+        except Exception:
+            log.exception("Job queue claim failed")
+            job = None
+        if job is None:
+            stopping.wait(QUEUE_POLL_INTERVAL)
+            continue
+        download_id, spec = job
+        trace_id_var.set(download_id)
+        try:
+            run_queued_job(download_id, spec)
+        except Exception:
+            log.exception(f"Queued job {download_id} failed")
+        finally:
+            job_queue.ack(download_id)
+
+def count_worker_processes():
+    """Bu süreci kaydet ve DOWNLOAD_FOLDER'ı paylaşan canlı worker sayısını döndür"""
+    hold_process_lock(f'worker-{os.getpid()}')
+    if fcntl is None:
+        return 1
+    live = 0
+    for name in os.listdir(OUTPUT_LOCK_FOLDER):
+        if not name.startswith('worker-'):
+            continue
+        path = os.path.join(OUTPUT_LOCK_FOLDER, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except BlockingIOError:
+            live += 1
+        else:
+            # Sahibi kapanmış
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+        finally:
+            os.close(fd)
+    return live
+
+def run_worker():
+    """`python -m app worker`: kuyruktan iş çekip indiren, web katmanından bağımsız süreç"""
+    if not job_queue:
+        raise SystemExit('worker için DOWNLOAD_QUEUE=sqlite veya redis ayarlanmalı')
+    workers = count_worker_processes()
+    if workers > STORAGE_PROCESS_COUNT:
+        # Her worker bütçenin 1/STORAGE_PROCESS_COUNT'unu kullanır; fazlası disk sınırını aşar
+        raise SystemExit(f"DOWNLOAD_FOLDER'ı {workers} worker paylaşıyor; "
+                         f"STORAGE_PROCESS_COUNT en az {workers} olmalı")
+    stopping = threading.Event()
+    
+    def stop(signum, frame):
+        log.info("Worker draining", extra={'signal': signum})
+        stopping.set()
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    start_job_journal()
+    threads = [threading.Thread(target=queue_worker_loop, args=(stopping,), daemon=True)
+               for _ in range(max(1, WORKER_CONCURRENCY))]
+    for thread in threads:
+        thread.start()
+    log.info("Worker started", extra={'queue': DOWNLOAD_QUEUE, 'concurrency': len(threads)})
+    while not stopping.wait(1):
+        pass
+    # Süren indirmeler bitmezse çıkışta günlüğe 'interrupted' yazılır ve başka worker devam eder
+    deadline = time.time() + WORKER_DRAIN_TIMEOUT
+    for thread in threads:
+        thread.join(max(0, deadline - time.time()))
 
-# Extension tokens: kalıcı tokenlar
-# {extension_token: {'user_session_id': str, 'browser': str, 'paired_at': float, 'last_sync': float}}
-extension_tokens = {}
+# ============ Process Pool ============
+# yt-dlp'nin regex/JSON ağırlıklı çıkarma işi GIL için istek işleyen thread'lerle yarışır.
+# PROCESS_POOL_SIZE > 0 ise çıkarma ayrı süreçlerde, DOWNLOADS_IN_PROCESS_POOL ile indirmeler de.
+PROCESS_POOL_SIZE = int(os.environ.get('PROCESS_POOL_SIZE', '0'))
+DOWNLOADS_IN_PROCESS_POOL = os.environ.get('DOWNLOADS_IN_PROCESS_POOL', '').lower() in ('1', 'true', 'yes')
+EXTRACTION_TIMEOUT = int(os.environ.get('EXTRACTION_TIMEOUT', '60'))
 
-# Rate limiting: extension_token -> [timestamp1, timestamp2, ...]
-rate_limits = {}
+# İşçi süreçte: web sürecine ilerleme göndermek için kuyruk
+worker_progress_queue = None
 
-# Sabitler
-PAIRING_TOKEN_TTL = 600  # 10 dakika
-RATE_LIMIT_WINDOW = 60  # 1 dakika
-RATE_LIMIT_MAX_REQUESTS = 2  # dakikada max 2 istek
+def init_pool_worker(progress_queue):
+    """İşçi süreci hazırla ve extractor'ları önceden yükle"""
+    global worker_progress_queue
+    worker_progress_queue = progress_queue
+    list(yt_dlp.extractor.gen_extractor_classes())
 
-def generate_pairing_code():
-    """6 haneli alfanumerik pairing kodu üret"""
-    chars = string.ascii_uppercase + string.digits
-    # Karışıklığı önlemek için benzer karakterleri çıkar (0, O, I, 1, L)
-    chars = chars.replace('0', '').replace('O', '').replace('I', '').replace('1', '').replace('L', '')
-    return ''.join(random.choices(chars, k=6))
+def publish_worker_progress(download_id, **fields):
+    worker_progress_queue.put((download_id, fields))
 
-def generate_extension_token():
-    """Güvenli extension token üret"""
-    return f"ext_{secrets.token_urlsafe(32)}"
+def call_in_worker(fn, *args):
+    """yt-dlp istisnaları her zaman pickle edilemez; mesajı düz bir istisna ile taşı"""
+    try:
+        return fn(*args)
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
 
-def cleanup_expired_tokens():
-    """Süresi dolmuş pairing token'ları temizle"""
-    current_time = time.time()
-    expired = [code for code, data in pairing_tokens.items() 
-               if current_time - data['created_at'] > PAIRING_TOKEN_TTL]
-    for code in expired:
-        del pairing_tokens[code]
-    return len(expired)
+class WorkerProcessPool:
+    """yt-dlp işlerini önceden ısıtılmış ayrı süreçlerde çalıştıran, çökmeye dayanıklı havuz"""
 
-def check_rate_limit(extension_token):
-    """Rate limit kontrolü - dakikada max 2 istek"""
-    current_time = time.time()
-    
-    if extension_token not in rate_limits:
-        rate_limits[extension_token] = []
-    
-    # Eski timestamplari temizle
-    rate_limits[extension_token] = [
-        ts for ts in rate_limits[extension_token] 
-        if current_time - ts < RATE_LIMIT_WINDOW
-    ]
-    
-    # Limit kontrolü
-    if len(rate_limits[extension_token]) >= RATE_LIMIT_MAX_REQUESTS:
-        oldest = min(rate_limits[extension_token])
-        retry_after = int(RATE_LIMIT_WINDOW - (current_time - oldest)) + 1
-        return False, retry_after
-    
-    # Yeni istek ekle
-    rate_limits[extension_token].append(current_time)
-    return True, 0
+    progress_queue = None
+    progress_queue_pid = None
+    shared_lock = threading.Lock()
 
-def cookies_to_netscape(cookies):
-    """JSON cookie array'ini Netscape formatına çevir"""
-    lines = ["# Netscape HTTP Cookie File", "# https://curl.haxx.se/rfc/cookie_spec.html", "# This file was generated by Video Downloader Extension", ""]
-    
-    for cookie in cookies:
-        domain = cookie.get('domain', '')
-        # Domain başında nokta yoksa ekle (subdomain eşleşmesi için)
-        if domain and not domain.startswith('.'):
-            domain = '.' + domain
-        
-        flag = 'TRUE' if domain.startswith('.') else 'FALSE'
-        path = cookie.get('path', '/')
-        secure = 'TRUE' if cookie.get('secure', False) else 'FALSE'
-        
-        # Expiration: -1 veya None ise session cookie, 0 yapabiliriz
-        expiration = cookie.get('expirationDate', 0)
-        if expiration is None or expiration < 0:
-            expiration = 0
-        else:
-            expiration = int(expiration)
-        
-        name = cookie.get('name', '')
-        value = cookie.get('value', '')
-        
-        if name and domain:
-            line = f"{domain}\t{flag}\t{path}\t{secure}\t{expiration}\t{name}\t{value}"
-            lines.append(line)
-    
-    return '\n'.join(lines)
+    def __init__(self, size):
+        self.size = size
+        self.executor = None
+        self.pid = None
+        self.lock = threading.Lock()
 
-# Download klasörü
-DOWNLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'downloads')
-try:
-    if not os.path.exists(DOWNLOAD_FOLDER):
-        os.makedirs(DOWNLOAD_FOLDER)
-except Exception as e:
-    print(f"Warning: Could not create downloads folder: {e}")
+    @property
+    def enabled(self):
+        return self.size > 0
 
-# Cookie dosyası klasörü
-COOKIE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cookies')
-try:
-    if not os.path.exists(COOKIE_FOLDER):
-        os.makedirs(COOKIE_FOLDER)
-except Exception as e:
-    print(f"Warning: Could not create cookies folder: {e}")
+    @classmethod
+    def get_progress_queue(cls):
+        # Kuyruk ve onu okuyan thread her web süreci için bir kez oluşturulur
+        with cls.shared_lock:
+            if cls.progress_queue_pid != os.getpid():
+                cls.progress_queue = multiprocessing.get_context('spawn').Queue()
+                cls.progress_queue_pid = os.getpid()
+                threading.Thread(target=cls.relay_progress, args=(cls.progress_queue,), daemon=True).start()
+            return cls.progress_queue
 
-# İndirme durumlarını takip etmek için
-download_status = {}
+    @staticmethod
+    def relay_progress(progress_queue):
+        while True:
+            download_id, fields = progress_queue.get()
+            update_download_status(download_id, **fields)
 
-# Bellek temizliği için eski download'ları sil
-def cleanup_old_downloads():
-    """1 saatten eski download durumlarını temizle"""
-    current_time = time.time()
-    expired = [did for did, data in download_status.items() 
-               if current_time - data.get('created_at', current_time) > 3600]
-    for did in expired:
-        del download_status[did]
-    return len(expired)
+    def _get_executor(self):
+        with self.lock:
+            # gunicorn --preload fork'undan sonra her worker kendi havuzunu kurar
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_pool_worker,
+                    initargs=(self.get_progress_queue(),)
+                )
+                self.pid = os.getpid()
+                # Süreçleri şimdi başlat ki ilk istek extractor yüklemesini beklemesin
+                for _ in range(self.size):
+                    self.executor.submit(os.getpid)
+            return self.executor
 
-# Ortam tespiti
-IS_SERVER = os.environ.get('RAILWAY_ENVIRONMENT') or os.environ.get('RENDER') or os.environ.get('FLY_APP_NAME')
+    def _reset(self, executor, timed_out=False):
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+            # ProcessPoolExecutor tek bir süreci öldürmeye izin vermez (havuz bozulur); aynı havuzdaki
+            # diğer işler bu işaretle kendilerinin suçsuz olduğunu anlayıp yeni havuzda tekrarlanır
+            executor.reset_for_timeout = timed_out
+        # Takılan ya da çöken süreçleri sonlandır
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
 
-print(f"[DEBUG] IS_SERVER: {IS_SERVER}", file=sys.stderr)
+    def run(self, fn, *args, timeout=None):
+        """fn(*args) sonucunu işçi süreçten al.
 
-def get_ydl_opts(cookie_file=None):
-    """yt-dlp ayarları"""
-    opts = {
-        'quiet': False,
-        'verbose': True,
-        'no_warnings': False,
-        'age_limit': None,
-        'cachedir': False,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        }
-    }
-    
-    # Cookie dosyası varsa kullan
-    if cookie_file:
-        if os.path.exists(cookie_file):
-            opts['cookiefile'] = cookie_file
-            print(f"[DEBUG] Using cookie file: {cookie_file}", file=sys.stderr)
-        else:
-            print(f"[DEBUG] Cookie file path provided but file not found: {cookie_file}", file=sys.stderr)
-    # Yerel ortamda tarayıcı cookie'si kullan
-    elif not IS_SERVER:
-        for browser in ['firefox', 'chrome', 'edge', 'brave']:
+        Havuz başka bir işin zaman aşımı yüzünden sonlandırıldıysa iş yeni havuzda bir kez tekrarlanır.
+        """
+        for attempt in range(2):
+            executor = self._get_executor()
             try:
-                opts['cookiesfrombrowser'] = (browser,)
-                print(f"[DEBUG] Using browser cookies: {browser}", file=sys.stderr)
-                break
-            except:
-                continue
-    else:
-        print(f"[DEBUG] No cookie file provided to get_ydl_opts", file=sys.stderr)
+                return executor.submit(call_in_worker, fn, *args).result(timeout=timeout)
+            except (BrokenProcessPool, CancelledError):
+                self._reset(executor)
+                if attempt == 0 and getattr(executor, 'reset_for_timeout', False):
+                    log.warning("Retrying task after process pool reset")
+                    continue
+                raise RuntimeError('İşlem süreci beklenmedik şekilde sonlandı')
+            except FuturesTimeoutError:
+                self._reset(executor, timed_out=True)
+                raise TimeoutError(f'İşlem {timeout} saniye içinde tamamlanmadı')
 
-    
-    return opts
+extraction_pool = WorkerProcessPool(PROCESS_POOL_SIZE)
+download_pool = WorkerProcessPool(MAX_CONCURRENT_DOWNLOADS if DOWNLOADS_IN_PROCESS_POOL else 0)
 
-def sanitize_filename(filename):
-    """Dosya adından geçersiz karakterleri temizle"""
-    return re.sub(r'[<>:"/\\|?*]', '', filename)
+# ============ Batch / Playlist Jobs ============
+# Playlist ve kanal sekmeleri extract_flat ile sayfa sayfa açılır, her video ayrı bir iş olur
+BATCH_MAX_ENTRIES = int(os.environ.get('BATCH_MAX_ENTRIES', '200'))
+BATCH_EXPAND_WORKERS = 2
 
-def get_video_info(url, cookie_file=None):
-    """Video bilgilerini al"""
-    ydl_opts = get_ydl_opts(cookie_file)
-    ydl_opts['extract_flat'] = False
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-        
-        # Mevcut formatları logla
-        available_formats = info.get('formats', [])
-        print(f"[DEBUG] Available formats count: {len(available_formats)}", file=sys.stderr)
-        for f in available_formats[:5]:  # İlk 5 formatı göster
-            print(f"[DEBUG] Format: {f.get('format_id')} - {f.get('ext')} - {f.get('height')}p", file=sys.stderr)
-        
-        formats = [
-            {'format_id': 'best', 'quality': 'En İyi Kalite', 'ext': 'mp4', 'type': 'video+audio'},
-            {'format_id': '1080p', 'quality': '1080p (Full HD)', 'ext': 'mp4', 'type': 'video+audio'},
-            {'format_id': '720p', 'quality': '720p (HD)', 'ext': 'mp4', 'type': 'video+audio'},
-            {'format_id': '480p', 'quality': '480p', 'ext': 'mp4', 'type': 'video+audio'},
-            {'format_id': '360p', 'quality': '360p', 'ext': 'mp4', 'type': 'video+audio'},
-            {'format_id': 'bestaudio', 'quality': 'Sadece Ses (M4A)', 'ext': 'm4a', 'type': 'audio'},
-        ]
-        
-        return {
-            'title': info.get('title', 'Bilinmeyen'),
-            'thumbnail': info.get('thumbnail'),
-            'duration': info.get('duration'),
-            'uploader': info.get('uploader', 'Bilinmeyen'),
-            'view_count': info.get('view_count'),
-            'formats': formats,
-            'age_restricted': info.get('age_limit', 0) >= 18
-        }
+batch_jobs = create_state_store('batch_jobs')
+batch_expander = ThreadPoolExecutor(max_workers=BATCH_EXPAND_WORKERS)
 
-def download_video(url, format_id, download_id, cookie_file=None):
-    """Video indir"""
-    print(f"[DEBUG] Starting download for {download_id} with cookie: {cookie_file}", file=sys.stderr)
-    download_status[download_id] = {
-        'status': 'downloading', 
-        'progress': 0, 
-        'filename': None,
-        'created_at': time.time()
-    }
+def expand_batch(batch_id, urls, format_id, cookie_file, session_id, limit, transfer=None):
+    """Playlist'i tembel olarak gez ve her girdi için indirme işi oluştur"""
+    entries = []
     
-    def progress_hook(d):
-        if d['status'] == 'downloading':
-            total = d.get('total_bytes') or d.get('total_bytes_estimate', 0)
-            downloaded = d.get('downloaded_bytes', 0)
-            if total > 0:
-                download_status[download_id]['progress'] = int((downloaded / total) * 100)
-        elif d['status'] == 'finished':
-            download_status[download_id]['progress'] = 100
-
-    output_template = os.path.join(DOWNLOAD_FOLDER, f'{download_id}_%(title)s.%(ext)s')
+    def add_entry(url, title=None, duration=None):
+        download_id = enqueue_download(url, format_id, cookie_file, session_id=session_id,
+                                       duration=duration, transfer=transfer)
+        entries.append({'download_id': download_id, 'url': url, 'title': title})
+        batch_jobs.patch(batch_id, entries=entries)
     
-    # Basitleştirilmiş format seçenekleri
-    if format_id == 'bestaudio':
-        format_string = 'bestaudio/best'
-    elif format_id == '1080p':
-        format_string = 'bv*[height<=1080]+ba/b[height<=1080]/b'
-    elif format_id == '720p':
-        format_string = 'bv*[height<=720]+ba/b[height<=720]/b'
-    elif format_id == '480p':
-        format_string = 'bv*[height<=480]+ba/b[height<=480]/b'
-    elif format_id == '360p':
-        format_string = 'bv*[height<=360]+ba/b[height<=360]/b'
-    else:  # best
-        format_string = 'bv*+ba/b'
+    try:
+        if len(urls) > 1:
+            for url in urls[:limit]:
+                add_entry(url)
+        else:
+            overrides = {'extract_flat': 'in_playlist', 'lazy_playlist': True}
+            with ydl_pool.checkout(cookie_file, overrides) as ydl:
+                # process=False: girdiler çözülmeden, ihtiyaç oldukça sayfalanarak gelir
+                result = ydl.extract_info(urls[0], download=False, process=False)
+                if result.get('_type') in ('playlist', 'multi_video'):
+                    batch_jobs.patch(batch_id, title=result.get('title'))
+                    for entry in itertools.islice(result.get('entries') or [], limit):
+                        if not entry:
+                            continue
+                        url = entry.get('webpage_url') or entry.get('url')
+                        if url:
+                            add_entry(url, entry.get('title'), entry.get('duration'))
+                else:
+                    add_entry(urls[0], result.get('title'), result.get('duration'))
+        batch_jobs.patch(batch_id, status='running')
+    except Exception as e:
+        log.warning(f"Batch {batch_id} expansion failed: {e}")
+        batch_jobs.patch(batch_id, status='running' if entries else 'error', error=str(e))
+
+def get_batch_view(batch_id):
+    """Batch kaydını girdilerin güncel durumu ve toplam ilerleme ile birlikte döndür"""
+    batch = batch_jobs.get(batch_id)
+    if batch is None:
+        return None
     
-    print(f"[DEBUG] Using format string: {format_string}", file=sys.stderr)
+    entries = []
+    counts = {'completed': 0, 'error': 0}
+    progress_total = 0
+    for entry in batch['entries']:
+        status = get_download_status_view(entry['download_id']) or {'status': 'error', 'progress': 0}
+        entries.append(dict(entry, status=status['status'], progress=status.get('progress', 0),
+                            error=status.get('error')))
+        if status['status'] in counts:
+            counts[status['status']] += 1
+        progress_total += 100 if status['status'] in counts else status.get('progress', 0)
     
-    ydl_opts = get_ydl_opts(cookie_file)
-    ydl_opts.update({
-        'format': format_string,
-        'outtmpl': output_template,
-        'progress_hooks': [progress_hook],
-        'merge_output_format': 'mp4',
-        # FFmpeg ayarları
-        'prefer_ffmpeg': True,
-        'postprocessor_args': {
-            'ffmpeg': ['-c:v', 'copy', '-c:a', 'aac']
-        },
-    })
+    state = batch['status']
+    if state == 'running' and entries and counts['completed'] + counts['error'] == len(entries):
+        state = 'completed'
     
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        
-        for filename in os.listdir(DOWNLOAD_FOLDER):
-            if filename.startswith(download_id):
-                download_status[download_id]['status'] = 'completed'
-                download_status[download_id]['filename'] = filename
-                return
-        
-        download_status[download_id]['status'] = 'error'
-        download_status[download_id]['error'] = 'Dosya bulunamadı'
-    except Exception as e:
-        download_status[download_id]['status'] = 'error'
-        download_status[download_id]['error'] = str(e)
+    return {
+        'batch_id': batch_id,
+        'status': state,
+        'title': batch.get('title'),
+        'error': batch.get('error'),
+        'total': len(entries),
+        'completed': counts['completed'],
+        'failed': counts['error'],
+        'progress': int(progress_total / len(entries)) if entries else 0,
+        'entries': entries
+    }
+
+class ZipStream:
+    """zipfile'ın yazdığı baytları parça parça dışarı veren yazılabilir akış"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+def iter_batch_zip(filenames):
+    """Bitmiş dosyaları diske yazmadan ZIP olarak akıt"""
+    stream = ZipStream()
+    used_names = set()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for filename in filenames:
+            try:
+                reader = CachedFileReader(filename)
+            except OSError:
+                continue
+            name = get_display_filename(filename)
+            base, ext = os.path.splitext(name)
+            counter = 1
+            while name in used_names:
+                counter += 1
+                name = f'{base} ({counter}){ext}'
+            used_names.add(name)
+            
+            with reader, archive.open(name, 'w', force_zip64=True) as dest:
+                while True:
+                    chunk = reader.read(256 * 1024)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield stream.drain()
+            yield stream.drain()
+    yield stream.drain()
 
 # ============ Cookie Upload Routes ============
 
@@ -295,7 +3406,6 @@ def upload_cookie():
         session['session_id'] = str(uuid.uuid4())
     
     session_id = session['session_id']
-    cookie_path = os.path.join(COOKIE_FOLDER, f'{session_id}.txt')
     
     try:
         content = file.read().decode('utf-8')
@@ -304,14 +3414,13 @@ def upload_cookie():
         if '# Netscape HTTP Cookie File' not in content and '.youtube.com' not in content:
             return jsonify({'error': 'Geçersiz cookie dosyası formatı. Netscape formatında olmalı.'}), 400
         
-        with open(cookie_path, 'w') as f:
-            f.write(content)
+        cookie_store.write_content(session_id, content)
         
         session['has_cookies'] = True
-        print(f"[DEBUG] Cookie uploaded for session: {session_id}", file=sys.stderr)
-        print(f"[DEBUG] Cookie file size: {len(content)} bytes", file=sys.stderr)
+        log.info("Cookie uploaded", extra={'session_id': session_id, 'bytes': len(content)})
+        log.debug(f"Cookie file size: {len(content)} bytes")
         if content:
-            print(f"[DEBUG] Cookie first line: {content.splitlines()[0]}", file=sys.stderr)
+            log.debug(f"Cookie first line: {content.splitlines()[0]}")
         
         return jsonify({'success': True, 'message': 'Cookie dosyası başarıyla yüklendi'})
     except Exception as e:
@@ -337,9 +3446,7 @@ def delete_cookie():
     """Cookie dosyasını sil"""
     session_id = session.get('session_id')
     if session_id:
-        cookie_path = os.path.join(COOKIE_FOLDER, f'{session_id}.txt')
-        if os.path.exists(cookie_path):
-            os.remove(cookie_path)
+        cookie_store.delete(session_id)
     
     session.pop('has_cookies', None)
     return jsonify({'success': True})
@@ -347,12 +3454,12 @@ def delete_cookie():
 def get_user_cookie_file():
     """Kullanıcının cookie dosyasını al"""
     session_id = session.get('session_id')
-    print(f"[DEBUG] get_user_cookie_file - Session ID: {session_id}", file=sys.stderr)
+    log.debug(f"get_user_cookie_file - Session ID: {session_id}")
     
     if session_id:
         cookie_path = os.path.join(COOKIE_FOLDER, f'{session_id}.txt')
         exists = os.path.exists(cookie_path)
-        print(f"[DEBUG] Checking cookie path: {cookie_path}, Exists: {exists}", file=sys.stderr)
+        log.debug(f"Checking cookie path: {cookie_path}, Exists: {exists}")
         if exists:
             return cookie_path
     return None
@@ -362,31 +3469,16 @@ def get_user_cookie_file():
 @app.route('/api/extension/generate-token', methods=['POST'])
 def generate_token():
     """Pairing kodu oluştur (10 dakika geçerli)"""
-    # Önce süresi dolmuş tokenları temizle
-    cleanup_expired_tokens()
-    
     # Session ID oluştur veya mevcut olanı kullan
     if 'session_id' not in session:
         session['session_id'] = str(uuid.uuid4())
     
     user_session_id = session['session_id']
     
-    # Yeni pairing kodu oluştur
-    pairing_code = generate_pairing_code()
-    
-    # Aynı kullanıcının önceki pairing kodlarını sil
-    old_codes = [code for code, data in pairing_tokens.items() 
-                 if data['user_session_id'] == user_session_id]
-    for code in old_codes:
-        del pairing_tokens[code]
-    
-    # Yeni kodu kaydet
-    pairing_tokens[pairing_code] = {
-        'user_session_id': user_session_id,
-        'created_at': time.time()
-    }
+    # Yeni pairing kodu oluştur (aynı kullanıcının önceki kodu silinir)
+    pairing_code = token_registry.create_pairing_code(user_session_id)
     
-    print(f"[DEBUG] Generated pairing code: {pairing_code} for session: {user_session_id}", file=sys.stderr)
+    log.info("Pairing code generated", extra={'session_id': user_session_id})
     
     return jsonify({
         'success': True,
@@ -408,31 +3500,18 @@ def pair_extension():
     if not pairing_code:
         return jsonify({'error': 'Pairing kodu gerekli'}), 400
     
-    # Süresi dolmuş tokenları temizle
-    cleanup_expired_tokens()
-    
-    # Pairing kodunu kontrol et
-    if pairing_code not in pairing_tokens:
+    # Pairing kodunu kontrol et ve sil (tek kullanımlık, aynı kod iki worker'da kullanılamaz)
+    token_data = token_registry.consume_pairing_code(pairing_code)
+    if token_data is None:
         return jsonify({'error': 'Geçersiz veya süresi dolmuş pairing kodu'}), 400
     
-    token_data = pairing_tokens[pairing_code]
     user_session_id = token_data['user_session_id']
     
-    # Extension token oluştur
-    ext_token = generate_extension_token()
-    
-    # Extension token'ı kaydet
-    extension_tokens[ext_token] = {
-        'user_session_id': user_session_id,
-        'browser': browser,
-        'paired_at': time.time(),
-        'last_sync': None
-    }
-    
-    # Pairing kodunu sil (tek kullanımlık)
-    del pairing_tokens[pairing_code]
+    # Extension token oluştur ve kaydet
+    ext_token = token_registry.add_extension(user_session_id, browser)
     
-    print(f"[DEBUG] Extension paired: {ext_token[:20]}... for session: {user_session_id}, browser: {browser}", file=sys.stderr)
+    log.info("Extension paired", extra={'token_prefix': ext_token[:TOKEN_PREFIX_LENGTH],
+                                       'session_id': user_session_id, 'browser': browser})
     
     return jsonify({
         'success': True,
@@ -480,45 +3559,53 @@ def push_cookies():
         return jsonify({'error': 'Geçersiz extension token'}), 401
     
     # Rate limit kontrolü
-    allowed, retry_after = check_rate_limit(ext_token)
-    if not allowed:
-        response = jsonify({
-            'error': 'Rate limit aşıldı. Lütfen bekleyin.',
-            'retry_after': retry_after
-        })
-        response.headers['Retry-After'] = str(retry_after)
-        return response, 429
+    if push_cookies_limiter.enabled:
+        allowed, remaining, reset, retry_after = push_cookies_limiter.hit(ext_token)
+        g.rate_limit_headers = push_cookies_limiter.headers(remaining, reset, retry_after)
+        if not allowed:
+            return rate_limit_response(retry_after)
     
     data = request.get_json()
+    # Tam set: {'cookies': [...]}; fark: {'base_etag': str, 'upsert': [...], 'remove': [...]}
+    is_delta = 'base_etag' in data
     cookies = data.get('cookies', [])
     
-    if not cookies:
+    if not is_delta and not cookies:
         return jsonify({'error': 'Cookie listesi boş'}), 400
     
     # Token bilgilerini al
     token_data = extension_tokens[ext_token]
     user_session_id = token_data['user_session_id']
     
-    # Cookie'leri Netscape formatına çevir
-    netscape_content = cookies_to_netscape(cookies)
-    
-    # Cookie dosyasını kaydet
-    cookie_path = os.path.join(COOKIE_FOLDER, f'{user_session_id}.txt')
-    
     try:
-        with open(cookie_path, 'w') as f:
-            f.write(netscape_content)
+        if is_delta:
+            result = cookie_store.apply_delta(
+                user_session_id, data['base_etag'], data.get('upsert', []), data.get('remove', []))
+            if result is None:
+                # Sunucudaki set farklı; extension tam seti göndermeli
+                return jsonify({
+                    'error': 'Cookie seti güncel değil, tam senkronizasyon gerekli',
+                    'etag': cookie_store.etag(user_session_id)
+                }), 412
+        else:
+            result = cookie_store.replace(user_session_id, cookies)
+        etag, changed, count = result
         
         # Son senkronizasyon zamanını güncelle
-        extension_tokens[ext_token]['last_sync'] = time.time()
+        extension_tokens.patch(ext_token, last_sync=time.time())
         
-        print(f"[DEBUG] Cookies pushed from extension for session: {user_session_id}, count: {len(cookies)}", file=sys.stderr)
+        log.info("Cookies pushed from extension", extra={
+            'session_id': user_session_id, 'count': count, 'delta': is_delta, 'changed': changed})
         
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'message': f'{len(cookies)} cookie başarıyla kaydedildi',
-            'synced_at': time.time()
+            'message': f'{count} cookie başarıyla kaydedildi',
+            'synced_at': time.time(),
+            'etag': etag,
+            'changed': changed
         })
+        response.headers['ETag'] = f'"{etag}"'
+        return response
     except Exception as e:
         return jsonify({'error': f'Cookie kaydedilirken hata: {str(e)}'}), 500
 
@@ -532,14 +3619,13 @@ def list_extensions():
     
     # Bu session'a bağlı extension'ları bul
     connected = []
-    for ext_token, data in extension_tokens.items():
-        if data['user_session_id'] == session_id:
-            connected.append({
-                'token_prefix': ext_token[:12] + '...',
-                'browser': data['browser'],
-                'paired_at': data['paired_at'],
-                'last_sync': data['last_sync']
-            })
+    for ext_token, data in token_registry.list_extensions(session_id):
+        connected.append({
+            'token_prefix': ext_token[:TOKEN_PREFIX_LENGTH] + '...',
+            'browser': data['browser'],
+            'paired_at': data['paired_at'],
+            'last_sync': data['last_sync']
+        })
     
     return jsonify({'extensions': connected})
 
@@ -555,17 +3641,12 @@ def revoke_extension():
     token_prefix = data.get('token_prefix', '')
     
     # Token prefix ile eşleşen extension'ı bul ve sil
-    to_delete = None
-    for ext_token, ext_data in extension_tokens.items():
-        if ext_data['user_session_id'] == session_id and ext_token.startswith(token_prefix.replace('...', '')):
-            to_delete = ext_token
-            break
+    to_delete = token_registry.find_by_prefix(session_id, token_prefix.replace('...', ''))
     
     if to_delete:
-        del extension_tokens[to_delete]
+        token_registry.revoke(session_id, to_delete)
         # Rate limit verisini de temizle
-        if to_delete in rate_limits:
-            del rate_limits[to_delete]
+        push_cookies_limiter.forget(to_delete)
         return jsonify({'success': True, 'message': 'Extension bağlantısı kesildi'})
     
     return jsonify({'error': 'Extension bulunamadı'}), 404
@@ -573,8 +3654,6 @@ def revoke_extension():
 @app.route('/api/extension/pairing-status/<pairing_code>')
 def get_pairing_status(pairing_code):
     """Pairing kodunun durumunu kontrol et"""
-    cleanup_expired_tokens()
-    
     if pairing_code in pairing_tokens:
         return jsonify({'status': 'pending'})
     
@@ -587,6 +3666,48 @@ def get_pairing_status(pairing_code):
     
     return jsonify({'status': 'expired'})
 
+TIMED_ENDPOINTS = {'get_info': 'info', 'start_download': 'download'}
+
+@app.before_request
+def start_request_timer():
+    start_job_journal()
+    g.request_started_at = time.perf_counter()
+    g.trace_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+    trace_id_var.set(g.trace_id)
+
+@app.after_request
+def add_trace_header(response):
+    if 'trace_id' in g:
+        response.headers['X-Request-ID'] = g.trace_id
+    return response
+
+@app.after_request
+def record_request_latency(response):
+    """Pahalı endpoint'lerin uçtan uca süresini ölç"""
+    endpoint = TIMED_ENDPOINTS.get(request.endpoint)
+    if endpoint and 'request_started_at' in g:
+        METRICS['request'].observe(time.perf_counter() - g.request_started_at, endpoint=endpoint)
+    return response
+
+@app.before_request
+def enforce_rate_limit():
+    """Pahalı endpoint'leri istemci (ve session modunda ayrıca IP) başına sınırla"""
+    if request.method == 'OPTIONS':
+        return None
+    for limiter, client in get_rate_limiters():
+        allowed, remaining, reset, retry_after = limiter.hit(client)
+        # Header'lar ilk (istemci) limiti ya da reddeden limiti gösterir
+        if 'rate_limit_headers' not in g or not allowed:
+            g.rate_limit_headers = limiter.headers(remaining, reset, retry_after)
+        if not allowed:
+            return rate_limit_response(retry_after)
+    return None
+
+@app.after_request
+def add_rate_limit_headers(response):
+    response.headers.update(g.get('rate_limit_headers', {}))
+    return response
+
 # CORS middleware for extension requests
 @app.after_request
 def add_cors_headers(response):
@@ -605,9 +3726,55 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'message': 'Application is running',
-        'timestamp': time.time()
+        'timestamp': time.time(),
+        'downloads': download_scheduler.stats(),
+        'metadata_cache': metadata_cache.stats(),
+        'file_cache': file_cache.stats(),
+        'cookie_store': cookie_store.stats(),
+        'ydl_pool': ydl_pool.stats(),
+        'janitor': janitor.stats(),
+        'storage': storage.stats(),
+        'job_journal': job_journal.stats(),
+        'job_queue': job_queue.stats() if job_queue else None,
+        'bandwidth': bandwidth_governor.stats()
     })
 
+def get_folder_size(folder):
+    """Klasördeki dosyaların toplam boyutu (bayt)"""
+    total = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metin formatında metrikler"""
+    scheduler = download_scheduler.stats()
+    storage_stats = storage.stats()
+    bandwidth_stats = bandwidth_governor.stats()
+    gauges = [
+        ('vd_active_jobs', 'Download jobs currently running', scheduler['active']),
+        ('vd_queue_depth', 'Download jobs waiting in the scheduler queue', scheduler['queued']),
+        ('vd_download_status_entries', 'Entries in download_status', len(download_status)),
+        ('vd_download_folder_bytes', 'Disk used by DOWNLOAD_FOLDER', get_folder_size(DOWNLOAD_FOLDER)),
+        ('vd_storage_reserved_bytes', 'Quota reserved by running downloads', storage_stats['reserved_bytes']),
+        ('vd_storage_free_bytes', 'Free disk space on the download volume', storage_stats['free_disk_bytes']),
+        ('vd_bandwidth_allocated_bytes', 'Bandwidth allocated to running downloads (bytes/s)',
+         bandwidth_stats['allocated']),
+        ('vd_bandwidth_achieved_bytes', 'Measured speed of running downloads (bytes/s)', bandwidth_stats['achieved']),
+        ('vd_extension_tokens', 'Live extension tokens', len(extension_tokens)),
+    ]
+    
+    lines = []
+    for name, documentation, value in gauges:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} gauge', f'{name} {value}']
+    for metric in METRICS.values():
+        lines += metric.render()
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/ping')
 def ping():
     """Simple ping endpoint for keep-alive"""
@@ -674,56 +3841,368 @@ def start_download():
     if not url:
         return jsonify({'error': 'URL gerekli'}), 400
     
-    download_id = str(uuid.uuid4())[:8]
+    try:
+        clip = parse_clip_options(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     cookie_file = get_user_cookie_file()
-    print(f"[DEBUG] start_download - Cookie file: {cookie_file}", file=sys.stderr)
+    log.debug(f"start_download - Cookie file: {cookie_file}")
+    
+    download_id = enqueue_download(
+        url, format_id, cookie_file,
+        session_id=session.get('session_id') or request.remote_addr,
+        duration=data.get('duration'),
+        transfer=parse_transfer_options(data),
+        clip=clip
+    )
     
-    thread = threading.Thread(target=download_video, args=(url, format_id, download_id, cookie_file))
-    thread.start()
+    status = download_status.get(download_id)
+    if status and status['status'] == 'error':
+        # Kota/disk kabul kontrolünü geçemedi
+        return jsonify({'download_id': download_id, 'error': status['error']}), 507
     
     return jsonify({'download_id': download_id})
 
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """Playlist ya da URL listesi için toplu indirme başlat"""
+    data = request.get_json()
+    urls = data.get('urls') or ([data['url']] if data.get('url') else [])
+    format_id = data.get('format_id', 'best')
+    limit = data.get('limit')
+    try:
+        limit = BATCH_MAX_ENTRIES if limit is None else int(limit)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Geçersiz limit'}), 400
+    if limit < 1 or isinstance(data.get('limit'), bool):
+        return jsonify({'error': 'Geçersiz limit'}), 400
+    limit = min(limit, BATCH_MAX_ENTRIES)
+    
+    if not urls:
+        return jsonify({'error': 'URL gerekli'}), 400
+    if any(not u.startswith(('http://', 'https://')) for u in urls):
+        return jsonify({'error': 'Geçersiz URL formatı'}), 400
+    
+    batch_id = str(uuid.uuid4())[:8]
+    batch_jobs[batch_id] = {
+        'status': 'expanding',
+        'format_id': format_id,
+        'entries': [],
+        'created_at': time.time()
+    }
+    janitor.expire(batch_jobs, batch_id, JOB_RECORD_TTL, is_batch_active)
+    
+    batch_expander.submit(
+        expand_batch, batch_id, urls, format_id, get_user_cookie_file(),
+        session.get('session_id') or request.remote_addr, limit, parse_transfer_options(data)
+    )
+    
+    return jsonify({'batch_id': batch_id})
+
+@app.route('/api/batch/<batch_id>')
+def get_batch_status(batch_id):
+    """Toplu indirmenin toplam ve girdi bazlı ilerlemesini döndür"""
+    batch = get_batch_view(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Toplu indirme bulunamadı'}), 404
+    
+    return jsonify(batch)
+
+@app.route('/api/batch/<batch_id>/zip')
+def get_batch_zip(batch_id):
+    """Tamamlanan dosyaları tek bir ZIP olarak akıt"""
+    batch = get_batch_view(batch_id)
+    if batch is None:
+        return jsonify({'error': 'Toplu indirme bulunamadı'}), 404
+    
+    filenames = []
+    for entry in batch['entries']:
+        status = download_status.get(entry['download_id'])
+        if status and status['status'] == 'completed' and status.get('filename'):
+            filenames.append(status['filename'])
+    if not filenames:
+        return jsonify({'error': 'Henüz tamamlanan dosya yok'}), 400
+    
+    archive_name = sanitize_filename(batch.get('title') or f'batch_{batch_id}') + '.zip'
+    response = Response(iter_batch_zip(filenames), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(archive_name)}"
+    return response
+
+STATUS_STREAM_MAX_DURATION = 300  # tarayıcı bundan sonra otomatik yeniden bağlanır
+STATUS_STREAM_WAKE_INTERVAL = 1  # diğer worker'lardaki değişiklikleri görmek için en geç bu kadar bekle
+STATUS_STREAM_HEARTBEAT = 15
+# Her WSGI akışı süresi boyunca bir thread tutar; sınır dolunca 503 döner ve sayfa polling'e geçer.
+# ASGI modunda (asgi.py) akışlar event loop'ta çalışır, bu sınıra tabi değildir.
+STATUS_STREAM_MAX_CONCURRENT = int(os.environ.get('STATUS_STREAM_MAX_CONCURRENT', '2'))
+status_stream_slots = threading.BoundedSemaphore(max(STATUS_STREAM_MAX_CONCURRENT, 1))
+
+def get_download_status_view(download_id):
+    """İstemciye döndürülecek durum (kuyruk sırası ve bağlı iş bilgisiyle)"""
+    status = download_status.get(download_id)
+    if status is None:
+        return None
+    
+    status = dict(status)
+    # Başka bir işe bağlanmış indirmeler o işin ilerlemesini gösterir
+    leader = download_status.get(status.get('attached_to'))
+    if leader and status['status'] == 'queued':
+        status.update({key: leader.get(key) for key in ('status', 'progress', 'speed', 'eta')})
+        download_id = status['attached_to']
+    if status['status'] == 'queued':
+        position = download_scheduler.position(download_id)
+        if position:
+            status['queue_position'] = position
+            status['queue_eta'] = download_scheduler.estimate_wait(position)
+    bandwidth = bandwidth_governor.job_stats(download_id)
+    if bandwidth:
+        status['bandwidth'] = bandwidth
+    
+    return status
+
 @app.route('/api/status/<download_id>')
 def get_status(download_id):
     """İndirme durumunu kontrol et"""
-    if download_id not in download_status:
+    status = get_download_status_view(download_id)
+    if status is None:
         return jsonify({'error': 'İndirme bulunamadı'}), 404
     
-    return jsonify(download_status[download_id])
+    return jsonify(status)
 
-@app.route('/api/file/<download_id>')
-def get_file(download_id):
-    """İndirilen dosyayı gönder"""
-    if download_id not in download_status:
+@app.route('/api/status/<download_id>/stream')
+def stream_status(download_id):
+    """İndirme durumunu Server-Sent Events ile gönder"""
+    if download_status.get(download_id) is None:
         return jsonify({'error': 'İndirme bulunamadı'}), 404
+    if STATUS_STREAM_MAX_CONCURRENT <= 0 or not status_stream_slots.acquire(blocking=False):
+        return jsonify({'error': 'Canlı takip şu an dolu, polling kullanın'}), 503
+    
+    def generate():
+        yield 'retry: 2000\n\n'
+        last_payload = None
+        last_sent = time.time()
+        deadline = time.time() + STATUS_STREAM_MAX_DURATION
+        while time.time() < deadline:
+            status = get_download_status_view(download_id)
+            if status is None:
+                payload = json.dumps({'status': 'error', 'error': 'İndirme bulunamadı'})
+                yield f'data: {payload}\n\n'
+                return
+            
+            payload = json.dumps(status, sort_keys=True)
+            if payload != last_payload:
+                last_payload = payload
+                last_sent = time.time()
+                yield f'data: {payload}\n\n'
+            elif time.time() - last_sent > STATUS_STREAM_HEARTBEAT:
+                last_sent = time.time()
+                yield ': keep-alive\n\n'
+            
+            if status['status'] in ('completed', 'error'):
+                return
+            
+            with status_changed:
+                status_changed.wait(timeout=STATUS_STREAM_WAKE_INTERVAL)
+    
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx tamponlamasın
+    response.call_on_close(status_stream_slots.release)
+    return response
+
+def find_download_file(download_id):
+    """Gönderilecek dosya adını döndür; yoksa (None, hata mesajı, HTTP kodu)"""
+    status = download_status.get(download_id)
+    if status is None:
+        return None, 'İndirme bulunamadı', 404
     
-    status = download_status[download_id]
     if status['status'] != 'completed':
-        return jsonify({'error': 'İndirme henüz tamamlanmadı'}), 400
+        return None, 'İndirme henüz tamamlanmadı', 400
     
     filename = status['filename']
-    filepath = os.path.join(DOWNLOAD_FOLDER, filename)
+    if not os.path.exists(os.path.join(DOWNLOAD_FOLDER, filename)):
+        return None, 'Dosya bulunamadı', 404
+    return filename, None, 200
+
+@app.route('/api/file/<download_id>')
+def get_file(download_id):
+    """İndirilen dosyayı gönder"""
+    filename, error, code = find_download_file(download_id)
+    if error:
+        return jsonify({'error': error}), code
     
-    if not os.path.exists(filepath):
-        return jsonify({'error': 'Dosya bulunamadı'}), 404
+    # Dosya önbellekte kalır; gönderim sürerken ve teslim edilene kadar LRU temizliği silmez
+    return send_download_file(filename, get_display_filename(filename))
+
+# ============ Async Serving ============
+# `uvicorn asgi:app` ile durum sorgusu, ilerleme akışı (SSE) ve dosya gönderimi asyncio
+# üzerinde coroutine olarak çalışır; binlerce boşta/yavaş bağlantı OS thread'i tutmaz. Diğer
+# route'lar a2wsgi ile sınırlı bir thread havuzundaki Flask uygulamasına aktarılır; yt-dlp işleri
+# zaten zamanlayıcı, süreç havuzu ve worker executor'larında çalışır.
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '8'))
+ASGI_FILE_CHUNK_SIZE = 256 * 1024
+ASYNC_ROUTE_PATTERN = re.compile(r'^/api/(status|file)/([^/]+?)(/stream)?$')
+
+async def read_state(fn, *args):
+    """Durum deposunu oku; disk/ağ backend'lerinde event loop'u bloklamamak için executor'da"""
+    if STATE_BACKEND == 'memory':
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+def encode_asgi_headers(headers, trace_id):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+            for name, value in {**headers, 'X-Request-ID': trace_id}.items()]
+
+async def send_asgi_response(send, status, headers, body=b'', trace_id=''):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': encode_asgi_headers(headers, trace_id)})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_asgi_json(send, payload, status, trace_id):
+    body = json.dumps(payload).encode('utf-8')
+    await send_asgi_response(send, status, {'Content-Type': 'application/json',
+                                            'Content-Length': len(body)}, body, trace_id)
+
+def watch_disconnect(receive):
+    """İstemci bağlantısı kopunca set edilen bir asyncio.Event ve izleyici görev döndür"""
+    disconnected = asyncio.Event()
     
-    clean_filename = sanitize_filename(filename[len(download_id)+1:])
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
     
-    response = send_file(filepath, as_attachment=True, download_name=clean_filename)
+    return disconnected, asyncio.ensure_future(watch())
+
+async def async_status(send, download_id, trace_id):
+    status = await read_state(get_download_status_view, download_id)
+    if status is None:
+        await send_asgi_json(send, {'error': 'İndirme bulunamadı'}, 404, trace_id)
+    else:
+        await send_asgi_json(send, status, 200, trace_id)
+
+async def async_status_stream(send, receive, download_id, trace_id):
+    """stream_status ile aynı SSE akışı; bekleme thread yerine coroutine'de"""
+    if await read_state(download_status.get, download_id) is None:
+        await send_asgi_json(send, {'error': 'İndirme bulunamadı'}, 404, trace_id)
+        return
     
-    def cleanup():
-        import time
-        time.sleep(60)
-        try:
-            os.remove(filepath)
-            if download_id in download_status:
-                del download_status[download_id]
-        except:
-            pass
+    await send({'type': 'http.response.start', 'status': 200, 'headers': encode_asgi_headers({
+        'Content-Type': 'text/event-stream; charset=utf-8',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }, trace_id)})
+    disconnected, watcher = watch_disconnect(receive)
     
-    threading.Thread(target=cleanup, daemon=True).start()
+    async def emit(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
     
-    return response
+    try:
+        await emit('retry: 2000\n\n')
+        last_payload = None
+        last_sent = time.time()
+        deadline = time.time() + STATUS_STREAM_MAX_DURATION
+        while time.time() < deadline and not disconnected.is_set():
+            status = await read_state(get_download_status_view, download_id)
+            if status is None:
+                await emit(f"data: {json.dumps({'status': 'error', 'error': 'İndirme bulunamadı'})}\n\n")
+                break
+            
+            payload = json.dumps(status, sort_keys=True)
+            if payload != last_payload:
+                last_payload = payload
+                last_sent = time.time()
+                await emit(f'data: {payload}\n\n')
+            elif time.time() - last_sent > STATUS_STREAM_HEARTBEAT:
+                last_sent = time.time()
+                await emit(': keep-alive\n\n')
+            
+            if status['status'] in ('completed', 'error'):
+                break
+            
+            await status_notifier.wait(STATUS_STREAM_WAKE_INTERVAL)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+
+async def async_file(scope, send, receive, download_id, trace_id):
+    """send_download_file ile aynı kurallar; yavaş istemci yalnızca bir coroutine'i bekletir"""
+    filename, error, code = await read_state(find_download_file, download_id)
+    if error:
+        await send_asgi_json(send, {'error': error}, code, trace_id)
+        return
+    
+    request_headers = Headers([(name.decode('latin-1'), value.decode('latin-1'))
+                               for name, value in scope['headers']])
+    status, headers, mimetype, byte_range = prepare_file_response(
+        filename, get_display_filename(filename), request_headers)
+    if mimetype:
+        headers['Content-Type'] = mimetype
+    if byte_range is None:
+        await send_asgi_response(send, status, headers, trace_id=trace_id)
+        return
+    
+    start, end, size = byte_range
+    remaining = end - start + 1
+    reader = CachedFileReader(filename, reaches_end=(end == size - 1))
+    disconnected, watcher = watch_disconnect(receive)
+    try:
+        reader.seek(start)
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': encode_asgi_headers(headers, trace_id)})
+        while remaining > 0 and not disconnected.is_set():
+            chunk = await asyncio.to_thread(reader.read, min(ASGI_FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        # Bağlantı koptuysa ya da dosya eksik okunduysa teslim edilmiş sayılmaz
+        reader.reaches_end = reader.reaches_end and remaining == 0 and not disconnected.is_set()
+        reader.close()
+
+def create_asgi_app():
+    """Hızlı yolları asyncio'da karşılayan, gerisini Flask'a aktaran ASGI uygulaması"""
+    from a2wsgi import WSGIMiddleware  # yalnızca ASGI modunda gerekli
+    wsgi = WSGIMiddleware(app, workers=ASGI_WSGI_THREADS)
+    
+    async def asgi_app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    start_job_journal()
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        
+        match = ASYNC_ROUTE_PATTERN.match(scope.get('path', '')) if scope['type'] == 'http' else None
+        if not match or scope['method'] != 'GET':
+            await wsgi(scope, receive, send)
+            return
+        
+        route, download_id, stream = match.groups()
+        trace_id = dict(scope['headers']).get(b'x-request-id', b'').decode('latin-1') or uuid.uuid4().hex[:16]
+        trace_id_var.set(trace_id)
+        if route == 'file' and not stream:
+            await async_file(scope, send, receive, download_id, trace_id)
+        elif route == 'status' and stream:
+            await async_status_stream(send, receive, download_id, trace_id)
+        elif route == 'status':
+            await async_status(send, download_id, trace_id)
+        else:
+            await wsgi(scope, receive, send)
+    
+    return asgi_app
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    if sys.argv[1:] == ['worker']:
+        run_worker()
+    else:
+        from werkzeug.serving import is_running_from_reloader
+        if is_running_from_reloader():
+            start_job_journal()
+        app.run(debug=True, port=5000)
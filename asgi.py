@@ -0,0 +1,9 @@
+"""
+ASGI giriş noktası: durum, ilerleme akışı ve dosya gönderimi asyncio üzerinde çalışır.
+
+Kullanım:
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+from app import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,401 @@
+"""
+Çevrimdışı uçtan uca yük testi.
+
+YouTube'a gitmeden servisi ölçmek için yerel bir sahte medya sunucusu başlatır
+(progressive MP4 ve ayrı video/ses akışlı DASH), uygulamayı ayrı bir süreçte
+çalıştırır ve /api/info -> /api/download -> /api/status -> /api/file akışını
+istenen eşzamanlılıkla sürer. yt-dlp bu URL'leri generic extractor ile açar.
+
+Kullanım:
+    python benchmarks/load_test.py --concurrency 8 --jobs 40
+    python benchmarks/load_test.py --media dash --size-mb 20 --json > bench_output.txt
+    python benchmarks/load_test.py --target http://127.0.0.1:5000   # çalışan sunucuya karşı
+
+DASH modu ve gerçek MP4 içeriği için ffmpeg gerekir; ffmpeg yoksa progressive
+mod rastgele baytlardan oluşan bir dosya sunar.
+"""
+import argparse
+import contextlib
+import http.server
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# ============ Sahte Medya Sunucusu ============
+
+def generate_media(folder, size_mb, duration):
+    """Test medyasını üret; ffmpeg varsa gerçek MP4/DASH, yoksa rastgele baytlar"""
+    ffmpeg = shutil.which('ffmpeg')
+    progressive = os.path.join(folder, 'progressive.mp4')
+    has_dash = False
+
+    if ffmpeg:
+        # Bit hızı, dosya yaklaşık size_mb olacak şekilde seçilir
+        bitrate = max(int(size_mb * 8 * 1024 / duration), 100)
+        source = ['-f', 'lavfi', '-i', f'testsrc=duration={duration}:size=1280x720:rate=30',
+                  '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+        encode = ['-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{bitrate}k',
+                  '-c:a', 'aac', '-b:a', '128k']
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', *source, *encode, progressive], check=True)
+
+        dash_folder = os.path.join(folder, 'dash')
+        os.makedirs(dash_folder, exist_ok=True)
+        subprocess.run([ffmpeg, '-y', '-loglevel', 'error', *source, *encode,
+                        '-map', '0:v', '-map', '1:a', '-f', 'dash', '-seg_duration', '2',
+                        os.path.join(dash_folder, 'manifest.mpd')], check=True)
+        has_dash = True
+    else:
+        with open(progressive, 'wb') as f:
+            remaining = int(size_mb * 1024 * 1024)
+            while remaining > 0:
+                chunk = os.urandom(min(remaining, 1024 * 1024))
+                f.write(chunk)
+                remaining -= len(chunk)
+
+    return has_dash
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Range destekli, sessiz statik dosya sunucusu"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        range_header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if not range_header or not range_header.startswith('bytes=') or not os.path.isfile(path):
+            return super().send_head()
+
+        size = os.path.getsize(path)
+        start_text, _, end_text = range_header[len('bytes='):].split(',')[0].partition('-')
+        if start_text:
+            start = int(start_text)
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        else:
+            start, end = max(size - int(end_text), 0), size - 1
+        if start >= size or start > end:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.end_headers()
+            return None
+
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self.range_remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, 'range_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+
+class OriginServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # yt-dlp sayfa yoklamasında bağlantıyı erken kapatır; bunlar hata değil
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_origin(folder):
+    """Sahte medya sunucusunu arka planda başlat, (sunucu, taban URL) döndür"""
+    handler = lambda *args, **kwargs: RangeRequestHandler(*args, directory=folder, **kwargs)
+    server = OriginServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+# ============ Uygulama Süreci ============
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app(workers, threads, download_folder):
+    """Uygulamayı gunicorn (varsa) ya da flask ile ayrı süreçte başlat"""
+    port = get_free_port()
+    env = dict(os.environ, RAILWAY_ENVIRONMENT='benchmark', PYTHONUNBUFFERED='1')
+    env.setdefault('FILE_CACHE_MAX_BYTES', str(20 * 1024 * 1024 * 1024))
+    # Tüm sanal kullanıcılar aynı IP'den gelir; istemci başına limitleri kapat
+    env.setdefault('RATE_LIMIT_INFO', '0')
+    env.setdefault('RATE_LIMIT_DOWNLOAD', '0')
+    if download_folder:
+        env['DOWNLOAD_FOLDER'] = download_folder
+
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+                   '--workers', str(workers), '--threads', str(threads), '--timeout', '300', 'app:app']
+    except ImportError:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port), '--with-threads']
+
+    log = open(os.path.join(tempfile.gettempdir(), 'video-downloader-bench-server.log'), 'w')
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + '/ping', timeout=1).read()
+            return process, base_url
+        except (urllib.error.URLError, ConnectionError):
+            if process.poll() is not None:
+                raise RuntimeError(f'Sunucu başlatılamadı, log: {log.name}')
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('Sunucu 60 saniye içinde hazır olmadı')
+
+
+def get_process_tree(pid):
+    """pid ve tüm alt süreçleri (Linux /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def read_rss_kb(pid):
+    """Süreç ağacının toplam anlık RSS'i (kB); ölçülemiyorsa None"""
+    total = 0
+    for child in get_process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total or None
+
+
+class RssSampler:
+    """Sunucu sürecinin en yüksek RSS değerini arka planda örnekle"""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss_kb(self.pid)
+            if rss and (self.peak_kb is None or rss > self.peak_kb):
+                self.peak_kb = rss
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+
+# ============ Yük Üretici ============
+
+def request_json(url, payload=None, timeout=300):
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def run_job(base_url, media_url, format_id, poll_interval, latencies):
+    """Tek bir kullanıcının info -> download -> status -> file akışı; indirilen bayt sayısını döndür"""
+    def timed(name, fn):
+        started_at = time.perf_counter()
+        result = fn()
+        latencies.setdefault(name, []).append(time.perf_counter() - started_at)
+        return result
+
+    job_started_at = time.perf_counter()
+    timed('info', lambda: request_json(base_url + '/api/info', {'url': media_url}))
+    download_id = timed('download', lambda: request_json(
+        base_url + '/api/download', {'url': media_url, 'format_id': format_id}))['download_id']
+
+    while True:
+        status = timed('status', lambda: request_json(f'{base_url}/api/status/{download_id}'))
+        if status['status'] == 'completed':
+            break
+        if status['status'] == 'error':
+            raise RuntimeError(status.get('error'))
+        time.sleep(poll_interval)
+
+    def fetch_file():
+        size = 0
+        with urllib.request.urlopen(f'{base_url}/api/file/{download_id}', timeout=300) as response:
+            while True:
+                chunk = response.read(256 * 1024)
+                if not chunk:
+                    return size
+                size += len(chunk)
+
+    size = timed('file', fetch_file)
+    latencies.setdefault('job', []).append(time.perf_counter() - job_started_at)
+    return size
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(latencies, total_bytes, errors, elapsed, jobs, peak_rss_kb):
+    endpoints = {}
+    for name, values in latencies.items():
+        endpoints[name] = {
+            'count': len(values),
+            'mean_ms': round(statistics.mean(values) * 1000, 1),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+        }
+    completed = jobs - len(errors)
+    return {
+        'jobs': jobs,
+        'completed': completed,
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'elapsed_s': round(elapsed, 2),
+        'jobs_per_s': round(completed / elapsed, 3) if elapsed else None,
+        'mb_per_s': round(total_bytes / elapsed / (1024 * 1024), 2) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_kb / 1024, 1) if peak_rss_kb else None,
+        'endpoints': endpoints,
+    }
+
+
+def print_report(report):
+    print(f"Jobs: {report['completed']}/{report['jobs']} completed, {report['errors']} errors "
+          f"in {report['elapsed_s']} s")
+    print(f"Throughput: {report['jobs_per_s']} jobs/s, {report['mb_per_s']} MB/s")
+    print(f"Peak server RSS: {report['peak_rss_mb']} MB")
+    print(f"{'endpoint':<10}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for name in ('info', 'download', 'status', 'file', 'job'):
+        row = report['endpoints'].get(name)
+        if row:
+            print(f"{name:<10}{row['count']:>8}{row['mean_ms']:>10}{row['p50_ms']:>10}"
+                  f"{row['p95_ms']:>10}{row['p99_ms']:>10}")
+    for sample in report['error_samples']:
+        print(f'error: {sample}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test with a local fake media origin')
+    parser.add_argument('--concurrency', type=int, default=4, help='eşzamanlı sanal kullanıcı sayısı')
+    parser.add_argument('--jobs', type=int, default=20, help='toplam iş sayısı')
+    parser.add_argument('--media', choices=('progressive', 'dash'), default='progressive')
+    parser.add_argument('--size-mb', type=float, default=10, help='üretilecek medya boyutu')
+    parser.add_argument('--duration', type=int, default=30, help='ffmpeg ile üretilecek medyanın süresi (sn)')
+    parser.add_argument('--format-id', default='best')
+    parser.add_argument('--shared', action='store_true',
+                        help='tüm işler aynı URL\'yi kullansın (önbellek yolunu ölçer)')
+    parser.add_argument('--poll-interval', type=float, default=0.25)
+    parser.add_argument('--target', help='çalışan bir sunucunun adresi; verilmezse uygulama başlatılır')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--json', action='store_true', help='raporu JSON olarak yaz')
+    args = parser.parse_args()
+
+    media_folder = tempfile.mkdtemp(prefix='vd-bench-media-')
+    download_folder = tempfile.mkdtemp(prefix='vd-bench-downloads-')
+    has_dash = generate_media(media_folder, args.size_mb, args.duration)
+    if args.media == 'dash' and not has_dash:
+        parser.error('DASH modu için ffmpeg gerekli')
+    origin, origin_url = start_origin(media_folder)
+    media_path = '/dash/manifest.mpd' if args.media == 'dash' else '/progressive.mp4'
+
+    process = None
+    try:
+        if args.target:
+            base_url = args.target.rstrip('/')
+        else:
+            process, base_url = start_app(args.workers, args.threads, download_folder)
+
+        latencies = {}
+        errors = []
+        total_bytes = 0
+        lock = threading.Lock()
+
+        def worker(index):
+            nonlocal total_bytes
+            # Her iş farklı URL kullanır; aksi halde bitmiş dosya önbelleği indirmeyi atlar
+            media_url = origin_url + media_path + ('' if args.shared else f'?job={index}')
+            job_latencies = {}
+            try:
+                size = run_job(base_url, media_url, args.format_id, args.poll_interval, job_latencies)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            with lock:
+                total_bytes += size
+                for name, values in job_latencies.items():
+                    latencies.setdefault(name, []).extend(values)
+
+        sampler = RssSampler(process.pid) if process else None
+        started_at = time.perf_counter()
+        with sampler or contextlib.nullcontext():
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(worker, range(args.jobs)))
+        elapsed = time.perf_counter() - started_at
+
+        report = summarize(latencies, total_bytes, errors, elapsed, args.jobs,
+                           sampler.peak_kb if sampler else None)
+        report['config'] = {key: value for key, value in vars(args).items() if key != 'json'}
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=30)
+        origin.shutdown()
+        shutil.rmtree(media_folder, ignore_errors=True)
+        shutil.rmtree(download_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Birleştirme (merge) CPU süresi karşılaştırması.
+
+ffmpeg ile ayrı video ve ses akışları üretir, ardından her senaryoyu iki şekilde
+birleştirir: eski sabit argümanlar (ses her zaman AAC'ye çevrilir) ve
+app.plan_remux'un seçtiği argümanlar. ffmpeg alt süreçlerinin kullanıcı+sistem
+CPU süresi ve duvar saati süresi raporlanır.
+
+Kullanım:
+    python benchmarks/remux_benchmark.py
+    python benchmarks/remux_benchmark.py --duration 120 --repeat 5 --json
+
+ffmpeg gereklidir.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from app import plan_remux  # noqa: E402
+
+LEGACY_ARGS = ['-c:v', 'copy', '-c:a', 'aac']
+
+# Senaryo: (ad, video dosyası, ses dosyası, yt-dlp'nin raporlayacağı format bilgileri)
+SCENARIOS = [
+    ('h264+aac', 'video.mp4', 'audio.m4a',
+     [{'vcodec': 'avc1.64001f', 'acodec': 'none', 'ext': 'mp4'},
+      {'vcodec': 'none', 'acodec': 'mp4a.40.2', 'ext': 'm4a'}]),
+    ('h264+opus', 'video.mp4', 'audio.webm',
+     [{'vcodec': 'avc1.64001f', 'acodec': 'none', 'ext': 'mp4'},
+      {'vcodec': 'none', 'acodec': 'opus', 'ext': 'webm'}]),
+]
+
+
+def generate_sources(ffmpeg, folder, duration):
+    """Test için ayrı video ve ses akışlarını üret"""
+    run = [ffmpeg, '-y', '-loglevel', 'error']
+    subprocess.run([*run, '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size=1280x720:rate=30',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', os.path.join(folder, 'video.mp4')], check=True)
+    sine = ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}']
+    subprocess.run([*run, *sine, '-c:a', 'aac', '-b:a', '128k', os.path.join(folder, 'audio.m4a')], check=True)
+    subprocess.run([*run, *sine, '-c:a', 'libopus', '-b:a', '128k', os.path.join(folder, 'audio.webm')], check=True)
+
+
+def merge(ffmpeg, video, audio, output, extra_args):
+    """yt-dlp'nin FFmpegMergerPP'si gibi birleştir; (cpu, wall) saniye döndür"""
+    cmd = [ffmpeg, '-y', '-loglevel', 'error', '-i', video, '-i', audio,
+           '-c', 'copy', '-map', '1:a:0', '-map', '0:v:0', *extra_args,
+           '-movflags', '+faststart', output]
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    subprocess.run(cmd, check=True)
+    wall = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return cpu, wall
+
+
+def run_benchmark(ffmpeg, folder, repeat):
+    results = []
+    output = os.path.join(folder, 'merged.mp4')
+    for name, video, audio, formats in SCENARIOS:
+        plan, planned_args = plan_remux(formats)
+        row = {'scenario': name, 'plan': plan}
+        for label, args in (('legacy', LEGACY_ARGS), ('planned', planned_args)):
+            samples = [merge(ffmpeg, os.path.join(folder, video), os.path.join(folder, audio), output, args)
+                       for _ in range(repeat)]
+            row[f'{label}_cpu'] = round(statistics.median(cpu for cpu, _ in samples), 3)
+            row[f'{label}_wall'] = round(statistics.median(wall for _, wall in samples), 3)
+        row['cpu_saved'] = round(1 - row['planned_cpu'] / row['legacy_cpu'], 3) if row['legacy_cpu'] else 0
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare merge CPU time of legacy vs planned remux arguments')
+    parser.add_argument('--duration', type=int, default=60, help='üretilecek medyanın süresi (sn)')
+    parser.add_argument('--repeat', type=int, default=3, help='senaryo başına tekrar sayısı')
+    parser.add_argument('--json', action='store_true', help='raporu JSON olarak yaz')
+    args = parser.parse_args()
+
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        parser.error('ffmpeg gerekli')
+
+    with tempfile.TemporaryDirectory(prefix='remux-bench-') as folder:
+        generate_sources(ffmpeg, folder, args.duration)
+        results = run_benchmark(ffmpeg, folder, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'scenario':<12} {'plan':<18} {'legacy cpu':>11} {'planned cpu':>12} {'saved':>7}")
+    for row in results:
+        print(f"{row['scenario']:<12} {row['plan']:<18} {row['legacy_cpu']:>10.3f}s "
+              f"{row['planned_cpu']:>11.3f}s {row['cpu_saved']:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
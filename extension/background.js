@@ -6,6 +6,7 @@ const STORAGE_KEYS = {
   EXTENSION_TOKEN: "extensionToken",
   LAST_SYNC: "lastSync",
   PENDING_COOKIES: "pendingCookies",
+  COOKIE_SNAPSHOT: "cookieSnapshot",
 };
 
 // Sabitler
@@ -267,14 +268,7 @@ async function syncCookiesBackground(serverUrl, token) {
       `[Video Downloader] Syncing ${allCookies.length} cookies after pairing`
     );
 
-    const response = await fetch(`${serverUrl}/api/extension/push-cookies`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        "X-Extension-Token": token,
-      },
-      body: JSON.stringify({ cookies: allCookies }),
-    });
+    const response = await pushCookies(serverUrl, token, allCookies);
 
     if (response.ok) {
       await chrome.storage.local.set({ [STORAGE_KEYS.LAST_SYNC]: Date.now() });
@@ -359,14 +353,7 @@ async function syncCookies(serverUrl, token) {
 
   console.log(`[Video Downloader] Syncing ${allCookies.length} cookies`);
 
-  const response = await fetch(`${serverUrl}/api/extension/push-cookies`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      "X-Extension-Token": token,
-    },
-    body: JSON.stringify({ cookies: allCookies }),
-  });
+  const response = await pushCookies(serverUrl, token, allCookies);
 
   if (response.status === 429) {
     console.log("[Video Downloader] Rate limited by server");
@@ -387,6 +374,89 @@ async function syncCookies(serverUrl, token) {
   console.log("[Video Downloader] Sync successful");
 }
 
+// ============ Cookie Delta Sync ============
+
+// Sunucuya son gönderilen set ve ETag'i saklanır; sonraki senkronizasyonlarda yalnızca
+// değişen/silinen cookie'ler gönderilir. Sunucudaki set farklıysa (412) tam set gönderilir.
+
+function cookieKey(cookie) {
+  const domain = cookie.domain.startsWith(".")
+    ? cookie.domain
+    : `.${cookie.domain}`;
+  return `${domain}\t${cookie.path || "/"}\t${cookie.name}`;
+}
+
+function cookieFingerprint(cookie) {
+  // Sunucunun dosyaya yazdığı alanlar
+  const expiration = Math.max(Math.floor(cookie.expirationDate || 0), 0);
+  return JSON.stringify([cookie.value, !!cookie.secure, expiration]);
+}
+
+function snapshotCookies(cookies) {
+  const snapshot = {};
+  for (const cookie of cookies) {
+    snapshot[cookieKey(cookie)] = cookieFingerprint(cookie);
+  }
+  return snapshot;
+}
+
+function postCookies(serverUrl, token, body) {
+  return fetch(`${serverUrl}/api/extension/push-cookies`, {
+    method: "POST",
+    headers: {
+      "Content-Type": "application/json",
+      "X-Extension-Token": token,
+    },
+    body: JSON.stringify(body),
+  });
+}
+
+async function pushCookies(serverUrl, token, allCookies) {
+  const stored = await chrome.storage.local.get(STORAGE_KEYS.COOKIE_SNAPSHOT);
+  const previous = stored[STORAGE_KEYS.COOKIE_SNAPSHOT];
+  const current = snapshotCookies(allCookies);
+
+  let response;
+  if (previous && previous.token === token && previous.etag) {
+    const upsert = allCookies.filter(
+      (cookie) => previous.cookies[cookieKey(cookie)] !== current[cookieKey(cookie)]
+    );
+    const remove = Object.keys(previous.cookies)
+      .filter((key) => !(key in current))
+      .map((key) => {
+        const [domain, path, name] = key.split("\t");
+        return { domain, path, name };
+      });
+
+    // Değişiklik olmasa da gönderilir: sunucu ETag'i doğrular, dosya silindiyse 412 döner
+    console.log(
+      `[Video Downloader] Delta sync: ${upsert.length} changed, ${remove.length} removed`
+    );
+    response = await postCookies(serverUrl, token, {
+      base_etag: previous.etag,
+      upsert,
+      remove,
+    });
+    if (response.status !== 412) {
+      return saveSnapshot(response, token, current);
+    }
+    console.log("[Video Downloader] Server cookie set changed, sending full set");
+  }
+
+  response = await postCookies(serverUrl, token, { cookies: allCookies });
+  return saveSnapshot(response, token, current);
+}
+
+async function saveSnapshot(response, token, cookies) {
+  if (response.ok) {
+    const data = await response.clone().json();
+    await chrome.storage.local.set({
+      [STORAGE_KEYS.COOKIE_SNAPSHOT]: { token, etag: data.etag, cookies },
+    });
+  }
+  return response;
+}
+
 // ============ Offline Queue ============
 
 async function addToQueue() {
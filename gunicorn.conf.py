@@ -0,0 +1,12 @@
+# Gunicorn çalışma dizinindeki bu dosyayı otomatik yükler (Procfile ve Dockerfile komutları değişmeden).
+# Ayarlar komut satırında kalır; burada yalnızca süreç kancaları var.
+
+def post_worker_init(worker):
+    """Her worker uygulamayı yükledikten sonra iş günlüğünü başlat.
+
+    --preload ile master'da başlatılan thread'ler fork'tan sonra kaybolur; ilk isteği
+    beklemek ise trafik almayan yeniden başlatılmış bir worker'da yarım kalan işlerin
+    sahipsiz kalması demek.
+    """
+    from app import start_job_journal
+    start_job_journal()